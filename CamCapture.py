@@ -1,14 +1,33 @@
 
 
-import PySpin
 import sys
 import time
 import keyboard
 import os
+# LIBSGUI_CAMERA=sim runs everything against the simulated camera in SimSpin instead of the Spinnaker SDK
+if os.environ.get('LIBSGUI_CAMERA', '').lower() == 'sim':
+    import SimSpin as PySpin
+else:
+    import PySpin
 import tkinter as tk
 from tkinter import font
 from PIL import ImageTk, Image
 import multiprocessing as mp
+import threading
+import queue
+from collections import deque
+import numpy as np
+from FrameWriter import FrameWriterPool, save_frame
+from FrameRing import FrameRing
+from SharedFrames import SharedFrameRing
+from RunFile import RunFileWriter, run_filename
+from ShotManifest import ShotManifest, MANIFEST_DIR
+from FrameLog import FrameLog, DROPPED_RING, DROPPED_WRITER
+from PixelFormats import bit_depth, frame_dtype, native_frame, preview_shift, LOSSLESS_16BIT_EXTENSIONS
+from ThumbnailCache import write_thumbnail
+from NodeSnapshot import NodeSnapshot, load_node_config
+from FrameStats import FrameStatistics, format_stats
+from DarkFrames import DarkLibrary, DarkSubtractor, build_master_dark, dark_key
 
 class TriggerType:
     """
@@ -26,6 +45,76 @@ class TriggerType:
 
 CHOSEN_TRIGGER = TriggerType.HARDWARE
 global shot_num
+global shot_manifest
+shot_manifest = None
+
+# Encoder threads writing frames to disk, and how many frames may wait for them before new ones are dropped
+NUM_WRITERS = 2
+WRITER_QUEUE_SIZE = 64
+# How often (in shots) to report writer backlog
+WRITER_REPORT_INTERVAL = 100
+# Frames held in the preallocated numpy ring. Raw buffers are copied into the ring once and released
+# straight away. Set to 0 to go back to converting every frame with Spinnaker and saving the converted image.
+RING_SIZE = 32
+# Frames kept in the shared memory channel read by the live viewer
+SHARED_FRAME_SLOTS = 8
+# Saving with this extension appends every shot of a run to one chunked HDF5 run file instead of one image per shot
+RUN_FILE_EXTENSION = 'h5'
+# h5py compression filter for run files: None, 'lzf' (fast) or 'gzip' (smaller)
+RUN_FILE_COMPRESSION = 'lzf'
+# Have Spinnaker push images to an event handler so the acquisition loop sleeps between triggers.
+# False polls GetNextImage with GRAB_TIMEOUT (ms) instead.
+EVENT_DRIVEN = True
+GRAB_TIMEOUT = 1000
+# Pixel format the camera sends. Anything deeper than Mono8 (Mono10/12/16, or packed Mono12p/Mono12Packed) is
+# kept at its native bit depth end to end and saved losslessly as 16 bit; only the live preview is cut to 8 bits.
+# Needs the frame ring.
+PIXEL_FORMAT = 'Mono8'
+# With more than one camera connected each camera gets its own process, writers and shot counter. Cameras wait
+# for each other at a barrier so they all begin acquiring together, or start alone after this many seconds.
+CAMERA_START_TIMEOUT = 30
+# Compute integrated intensity, peak, saturation, centroid and plume extent of every frame as it is grabbed.
+# They go to the frame log and the live viewer. Takes ~1.5 ms per 1280x1024 frame.
+FRAME_STATS = True
+# Subtract the cached master dark for the current camera settings (see DarkFrames) from the frames shown in the
+# live viewer. Saved frames and their statistics stay raw, the dark used is recorded in the frame log and run
+# file attributes (dark_frame). Needs the frame ring. Record darks with main(..., record_dark=N) while the
+# plasma is blocked.
+DARK_SUBTRACTION = False
+DARK_METHOD = 'median'
+# Write a small JPEG thumbnail at the viewer's scale next to every saved shot (see ThumbnailCache), so the viewer
+# doesn't decode full frames. Done by the writer threads, a few ms and a few tens of kB at most per 1280x1024
+# frame. Needs the frame ring. The viewer deletes the thumbnails of shots that have been deleted.
+WRITE_THUMBNAILS = False
+# Named sensor readout settings. The plasma only covers part of the 1280x1024 sensor, and reading out less of
+# it lets the camera run faster and saves bandwidth, memory and disk. Keys (all optional):
+#   binning / decimation    factor applied to both axes (1 = off). Binning sums pixels, decimation skips them
+#   width / height          ROI size in binned/decimated pixels, default the whole (binned) sensor
+#   offset_x / offset_y     ROI position, default centred on the sensor
+# Values are rounded down to what the camera accepts. The applied geometry is stored with every run.
+CAPTURE_PROFILES = {
+    'full': {},
+    'plume': {'width': 640, 'height': 512},
+    'plume-narrow': {'width': 640, 'height': 256},
+    'bin2': {'binning': 2},
+    'plume-bin2': {'binning': 2, 'width': 320, 'height': 256},
+}
+CAPTURE_PROFILE = 'full'
+# Camera settings applied at startup, 'Node Name: value' per line. Only nodes that differ from the camera's
+# current values are written. None leaves the camera as SpinView (or the last run) left it, which is the default
+# so settings made there are kept. To apply a file, point this at one saved on purpose, e.g. a run's
+# camera_config.txt or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Config', 'flir_cam_changables.txt')
+CAMERA_CONFIG = None
+# Nodes recorded in every run's camera_config.txt whether or not CAMERA_CONFIG is applied, the ones in
+# Config/flir_cam_changables.txt. Nodes the camera doesn't have are left out.
+RECORDED_NODES = ('AcquisitionFrameCount', 'AcquisitionBurstFrameCount', 'ExposureMode', 'ExposureTime',
+                  'ExposureAuto', 'AcquisitionFrameRate', 'ResultingFrameRate', 'AcquisitionFrameRateEnable',
+                  'AcquisitionLineRate', 'TriggerOverlap', 'TriggerDelay', 'GainSelector', 'Gain', 'GainAuto',
+                  'BlackLevelSelector', 'BlackLevel', 'Gamma', 'GammaEnable')
+# Nodes set elsewhere in this module, so CAMERA_CONFIG can't fight over them
+CONFIG_OWNED_NODES = ('TriggerMode', 'TriggerSelector', 'TriggerSource', 'AcquisitionMode', 'PixelFormat',
+                      'Width', 'Height', 'OffsetX', 'OffsetY', 'BinningHorizontal', 'BinningVertical',
+                      'DecimationHorizontal', 'DecimationVertical')
 
 # file_extension = 'png' # needs to be an input for main
 
@@ -52,41 +141,51 @@ def configure_trigger(cam):
     try:
         result = True
 
-        # Ensure trigger mode off
-        # The trigger must be disabled in order to configure whether the source
-        # is software or hardware.
-        if cam.TriggerMode.GetAccessMode() != PySpin.RW:
-            print('Unable to disable trigger mode (node retrieval). Aborting...')
-            return False
+        # Selector and source can only be changed with the trigger off, so only go through that when
+        # they differ from what the camera already has. reset_trigger leaves them alone at the end of a run.
+        source = PySpin.TriggerSource_Software if CHOSEN_TRIGGER == TriggerType.SOFTWARE else PySpin.TriggerSource_Line0
+        if (cam.TriggerSelector.GetValue() == PySpin.TriggerSelector_FrameStart
+                and cam.TriggerSource.GetValue() == source):
+            if cam.TriggerMode.GetValue() == PySpin.TriggerMode_On:
+                print('Trigger already configured...')
+                return result
+            print('Trigger selector and source already set...')
+        else:
+            # Ensure trigger mode off
+            # The trigger must be disabled in order to configure whether the source
+            # is software or hardware.
+            if cam.TriggerMode.GetAccessMode() != PySpin.RW:
+                print('Unable to disable trigger mode (node retrieval). Aborting...')
+                return False
 
-        cam.TriggerMode.SetValue(PySpin.TriggerMode_Off)
+            cam.TriggerMode.SetValue(PySpin.TriggerMode_Off)
 
-        print('Trigger mode disabled...')
+            print('Trigger mode disabled...')
 
-        # Set TriggerSelector to FrameStart
-        # For this example, the trigger selector should be set to frame start.
-        # This is the default for most cameras.
-        if cam.TriggerSelector.GetAccessMode() != PySpin.RW:
-            print('Unable to get trigger selector (node retrieval). Aborting...')
-            return False
+            # Set TriggerSelector to FrameStart
+            # For this example, the trigger selector should be set to frame start.
+            # This is the default for most cameras.
+            if cam.TriggerSelector.GetAccessMode() != PySpin.RW:
+                print('Unable to get trigger selector (node retrieval). Aborting...')
+                return False
 
-        cam.TriggerSource.SetValue(PySpin.TriggerSelector_FrameStart)
+            cam.TriggerSelector.SetValue(PySpin.TriggerSelector_FrameStart)
 
-        print('Trigger selector set to frame start...')
+            print('Trigger selector set to frame start...')
 
-        # Select trigger source
-        # The trigger source must be set to hardware or software while trigger
-        # mode is off.
-        if cam.TriggerSource.GetAccessMode() != PySpin.RW:
-            print('Unable to get trigger source (node retrieval). Aborting...')
-            return False
+            # Select trigger source
+            # The trigger source must be set to hardware or software while trigger
+            # mode is off.
+            if cam.TriggerSource.GetAccessMode() != PySpin.RW:
+                print('Unable to get trigger source (node retrieval). Aborting...')
+                return False
 
-        if CHOSEN_TRIGGER == TriggerType.SOFTWARE:
-            cam.TriggerSource.SetValue(PySpin.TriggerSource_Software)
-            print('Trigger source set to software...')
-        elif CHOSEN_TRIGGER == TriggerType.HARDWARE:
-            cam.TriggerSource.SetValue(PySpin.TriggerSource_Line0)
-            print('Trigger source set to hardware...')
+            if CHOSEN_TRIGGER == TriggerType.SOFTWARE:
+                cam.TriggerSource.SetValue(PySpin.TriggerSource_Software)
+                print('Trigger source set to software...')
+            elif CHOSEN_TRIGGER == TriggerType.HARDWARE:
+                cam.TriggerSource.SetValue(PySpin.TriggerSource_Line0)
+                print('Trigger source set to hardware...')
 
         # Turn trigger mode on
         # Once the appropriate trigger source has been set, turn trigger mode
@@ -101,6 +200,89 @@ def configure_trigger(cam):
     return result
 
 
+def _set_int_node(cam, name, value):
+    """
+    Sets an integer node, rounding the value down onto the node's increment and into its range. Nodes already
+    at that value aren't written.
+
+    :param cam: Camera
+    :param name: Node name, e.g. 'Width'
+    :param value: Requested value
+    :return: Value actually set, or None if the node isn't writable on this camera
+    """
+    node = getattr(cam, name, None)
+    if node is None or node.GetAccessMode() != PySpin.RW:
+        return None
+    lo, hi, inc = node.GetMin(), node.GetMax(), node.GetInc()
+    value = min(max(int(value), lo), hi)
+    value = lo + (value - lo) // inc * inc
+    # reads are cheaper than writes, and the camera usually still has the profile from last time
+    if node.GetValue() != value:
+        node.SetValue(value)
+    return value
+
+
+def capture_geometry(cam):
+    """
+    Reads back the sensor readout geometry the camera is set to
+
+    :param cam: Camera
+    :return: dict of width, height, offset_x, offset_y, binning_h, binning_v, decimation_h, decimation_v for the
+             nodes this camera has
+    """
+    geometry = {}
+    for key, name in (('width', 'Width'), ('height', 'Height'), ('offset_x', 'OffsetX'), ('offset_y', 'OffsetY'),
+                      ('binning_h', 'BinningHorizontal'), ('binning_v', 'BinningVertical'),
+                      ('decimation_h', 'DecimationHorizontal'), ('decimation_v', 'DecimationVertical')):
+        node = getattr(cam, name, None)
+        if node is not None and PySpin.IsReadable(node):
+            geometry[key] = node.GetValue()
+    return geometry
+
+
+def configure_capture_profile(cam, profile=CAPTURE_PROFILE):
+    """
+    Sets sensor binning, decimation and ROI from one of the CAPTURE_PROFILES. Has to run before acquisition
+    starts, as frame buffers are sized from the resulting width and height.
+
+    :param cam: Camera to configure
+    :param profile: Name of the profile in CAPTURE_PROFILES
+    :return: dict of the applied geometry (see capture_geometry) plus the profile name, or None on failure
+    """
+    print('*** CONFIGURING CAPTURE PROFILE ***\n')
+    if profile not in CAPTURE_PROFILES:
+        print('Unknown capture profile %s, choose one of %s. Aborting...' % (profile, ', '.join(CAPTURE_PROFILES)))
+        return None
+    settings = CAPTURE_PROFILES[profile]
+    try:
+        # Offsets go to 0 first so the ROI is free to grow, then binning and decimation set the maximum size
+        _set_int_node(cam, 'OffsetX', 0)
+        _set_int_node(cam, 'OffsetY', 0)
+        for name in ('BinningHorizontal', 'BinningVertical'):
+            if _set_int_node(cam, name, settings.get('binning', 1)) is None and settings.get('binning', 1) != 1:
+                print('Unable to set %s, ignoring...' % name)
+        for name in ('DecimationHorizontal', 'DecimationVertical'):
+            if _set_int_node(cam, name, settings.get('decimation', 1)) is None and settings.get('decimation', 1) != 1:
+                print('Unable to set %s, ignoring...' % name)
+
+        width = _set_int_node(cam, 'Width', settings.get('width', cam.WidthMax.GetValue()))
+        height = _set_int_node(cam, 'Height', settings.get('height', cam.HeightMax.GetValue()))
+        if width is None or height is None:
+            print('Unable to set image size. Aborting...')
+            return None
+        _set_int_node(cam, 'OffsetX', settings.get('offset_x', (cam.WidthMax.GetValue() - width) // 2))
+        _set_int_node(cam, 'OffsetY', settings.get('offset_y', (cam.HeightMax.GetValue() - height) // 2))
+
+    except PySpin.SpinnakerException as ex:
+        print('Error in configure_capture_profile: %s' % ex)
+        return None
+
+    geometry = capture_geometry(cam)
+    geometry['profile'] = profile
+    print('Capture profile %s: %s' % (profile, ', '.join('%s=%s' % i for i in geometry.items())))
+    return geometry
+
+
 def grab_next_image_by_trigger(cam):
     """
     This function acquires an image by executing the trigger node.
@@ -142,22 +324,262 @@ def grab_next_image_by_trigger(cam):
     return result
 
 
-def acquire_images(cam, twd, file_extension):
+def _recorded(save, shot, framelog=None, row=None):
+    """
+    Wraps a save callable so the shot is added to the shot manifest, and its save time to the frame log,
+    once it has been written.
+
+    :param save: Callable taking the filename to save to
+    :param shot: Shot number being saved
+    :param framelog: FrameLog of the run, or None
+    :param row: Row of the frame in the frame log
+    :return: Callable taking the filename
+    """
+    def job(filename):
+        save(filename)
+        if shot_manifest is not None:
+            shot_manifest.record(shot, filename)
+        if framelog is not None:
+            framelog.mark_saved(row, time.time())
+    return job
+
+
+def _save_with_thumbnail(frame, filename, bits=8):
+    """
+    Saves a frame, then its viewer thumbnail. A thumbnail that can't be written doesn't fail the shot.
+
+    :param frame: 2D array of pixel data
+    :param filename: Full path of the file to write
+    :param bits: Significant bits of the frame
+    :return: None
+    """
+    save_frame(frame, filename)
+    try:
+        write_thumbnail(frame, filename, bits)
+    except OSError as e:
+        print('Could not write thumbnail for %s: %s' % (filename, e))
+
+
+class GrabbedFrame:
+    """
+    One image taken off the camera, already copied out of the Spinnaker buffer
+    so the buffer could be handed back to the driver.
+    """
+    def __init__(self, status=0, width=0, height=0, frame_id=0, device_timestamp=0):
+        self.status = status        # Spinnaker image status, 0 if the image is complete
+        self.width = width
+        self.height = height
+        self.frame_id = frame_id
+        self.device_timestamp = device_timestamp
+        self.received = time.time()
+        self.slot = None            # ring slot holding the frame
+        self.frame = None           # view of the frame in the ring
+        self.image = None           # converted Spinnaker image, when no ring is used
+        self.overrun = False        # True if the ring was full and the frame was dropped
+        self.host_time = time.perf_counter()
+
+
+def grab_frame(image_result, ring, release=True, pixel_format='Mono8'):
+    """
+    Copies a Spinnaker image into the next ring slot, or converts it to Mono8 if there is no ring.
+
+    :param image_result: Image from GetNextImage or an image event
+    :param ring: FrameRing to copy into, None to convert through Spinnaker
+    :param release: Release the Spinnaker image afterwards. Images passed to event handlers are released by
+                    Spinnaker itself.
+    :param pixel_format: Pixel format the camera is sending, so packed formats can be unpacked into the ring
+    :return: GrabbedFrame
+    """
+    try:
+        frame_id = image_result.GetFrameID()
+        device_timestamp = image_result.GetTimeStamp()
+        if image_result.IsIncomplete():
+            return GrabbedFrame(image_result.GetImageStatus(), frame_id=frame_id, device_timestamp=device_timestamp)
+
+        grab = GrabbedFrame(0, image_result.GetWidth(), image_result.GetHeight(), frame_id, device_timestamp)
+        if ring is not None:
+            # Copy the raw buffer into the ring once
+            grab.slot = ring.claim()
+            if grab.slot is None:
+                grab.overrun = True
+            else:
+                grab.frame = ring.store(grab.slot, native_frame(image_result, pixel_format))
+        else:
+            #  Convert image to mono 8. The converted image owns its own buffer
+            grab.image = image_result.Convert(PySpin.PixelFormat_Mono8, PySpin.HQ_LINEAR)
+        return grab
+
+    finally:
+        if release:
+            image_result.Release()
+
+
+def _log_frame(framelog, shot, grab, status, image_stats=None):
+    """
+    Logs a grabbed frame and warns straight away if frames went missing before it.
+
+    :param framelog: FrameLog of the run
+    :param shot: Shot number given to the frame, -1 if none
+    :param grab: GrabbedFrame
+    :param status: Image status or FrameLog DROPPED_ code
+    :param image_stats: Optional FrameStatistics result for the frame
+    :return: Row of the frame in the log
+    """
+    row, missing = framelog.record(shot, grab.frame_id, grab.device_timestamp, grab.received, status,
+                                   grab.width, grab.height, image_stats)
+    if missing:
+        print('WARNING: %d frame(s) missing before frame ID %d (shot %d) - lost by the camera or in transfer'
+              % (missing, grab.frame_id, shot))
+    return row
+
+
+class FrameEventHandler(PySpin.ImageEventHandler):
+    """
+    Image event handler for event driven acquisition. Spinnaker calls
+    OnImageEvent from its own thread as each image arrives; the image is
+    copied out straight away and queued for the acquisition loop, which
+    blocks on the queue instead of polling the camera.
+    """
+    def __init__(self, ring, pixel_format='Mono8'):
+        super().__init__()
+        self.ring = ring
+        self.pixel_format = pixel_format
+        self.frames = queue.Queue()
+
+    def OnImageEvent(self, image):
+        try:
+            self.frames.put(grab_frame(image, self.ring, release=False, pixel_format=self.pixel_format))
+        except PySpin.SpinnakerException as ex:
+            print('Error in image event: %s' % ex)
+
+    def stop(self):
+        """
+        Wakes up the acquisition loop and tells it to finish
+
+        :return: None
+        """
+        self.frames.put(None)
+
+
+def _stop_requested(stop_event):
+    """
+    :param stop_event: multiprocessing Event set by the GUI to stop the camera. If None, esc stops the camera.
+    :return: True if acquisition should stop
+    """
+    if stop_event is not None:
+        return stop_event.is_set()
+    return keyboard.is_pressed('esc')
+
+
+def _wait_for_stop(stop_event, handler):
+    """
+    Blocks until a stop is requested, then stops the event handler's queue. Runs in its own thread.
+
+    :param stop_event: multiprocessing Event set by the GUI, or None to watch for esc
+    :param handler: FrameEventHandler to stop
+    :return: None
+    """
+    if stop_event is not None:
+        stop_event.wait()
+    else:
+        while not keyboard.is_pressed('esc'):
+            time.sleep(0.1)
+    handler.stop()
+
+
+def acquire_images(cam, twd, file_extension, num_writers=NUM_WRITERS, writer_queue_size=WRITER_QUEUE_SIZE,
+                   ring_size=RING_SIZE, shared_frames=None, event_driven=EVENT_DRIVEN, stop_event=None, stats=None,
+                   pixel_format=PIXEL_FORMAT, start_barrier=None, geometry=None, snapshot=None,
+                   frame_stats=FRAME_STATS, dark_subtraction=DARK_SUBTRACTION, record_dark=0):
     global shot_num
     """
-    This function acquires and saves 10 images from a device.
+    This function acquires images from a device until told to stop. Saving is handed off to a
+    FrameWriterPool so the grab loop never waits on encoding or disk. With file_extension 'h5' all
+    shots are appended to a single run file, otherwise each shot gets its own image file.
     Please see Acquisition example for more in-depth comments on acquiring images.
 
     :param cam: Camera to acquire images from.
     :type cam: CameraPtr
+    :param num_writers: Number of encoder threads saving frames
+    :param writer_queue_size: Number of frames allowed to wait for a writer before frames are dropped
+    :param ring_size: Number of frames in the preallocated numpy ring, 0 to convert and save through Spinnaker
+    :param shared_frames: Name of the shared memory block to publish frames to for the live viewer, None to disable
+    :param event_driven: Receive images through a Spinnaker image event handler instead of polling GetNextImage
+    :param stop_event: multiprocessing Event that stops acquisition when set. If None, pressing esc stops it.
+    :param stats: Optional dict filled with grab, drop and writer counts and latencies when acquisition ends
+    :param pixel_format: Camera pixel format, e.g. 'Mono8' or 'Mono12p'. Deeper formats are kept native.
+    :param start_barrier: multiprocessing Barrier shared by all camera processes, so every camera is armed before
+                          any of them begins acquiring. None when running a single camera.
+    :param geometry: Sensor geometry from configure_capture_profile, stored in the run file and frame log
+    :param snapshot: NodeSnapshot of the camera configuration, refreshed and saved with the frame log once
+                     acquisition is running
+    :param frame_stats: Compute per frame image statistics for the frame log and live viewer
+    :param dark_subtraction: Subtract the matching master dark from the live viewer's frames. Saved frames stay
+                             raw.
+    :param record_dark: Instead of saving shots, grab this many frames, combine them into a master dark for
+                        the current settings and stop
     :return: True if successful, False otherwise.
     :rtype: bool
     """
 
     print('*** IMAGE ACQUISITION ***\n')
+    writer = FrameWriterPool(num_writers, writer_queue_size)
+    ring = None
+    live = None
+    runfile = None
+    handler = None
+    grabbed = 0
+    incomplete = 0
+    overruns = 0
+    started = None
+    framelog = None
+    statistics = None
+    stats_times = deque(maxlen=10000)
+    subtractor = None
+    dark_buffer = None
+    dark_name = ''
+    dark_stack = None
+    dark_count = 0
     try:
         result = True
 
+        # Native pixel format. Deeper than 8 bits skips the Mono8 conversion entirely
+        if bit_depth(pixel_format) > 8:
+            if not ring_size:
+                print('%s needs the frame ring, falling back to Mono8...' % pixel_format)
+                pixel_format = 'Mono8'
+            elif file_extension not in LOSSLESS_16BIT_EXTENSIONS:
+                print('%s frames can\'t be saved losslessly as %s, use one of %s. Aborting...'
+                      % (pixel_format, file_extension, ', '.join(LOSSLESS_16BIT_EXTENSIONS)))
+                return False
+        if cam.PixelFormat.GetAccessMode() != PySpin.RW:
+            print('Unable to set pixel format. Aborting...')
+            return False
+        cam.PixelFormat.SetValue(getattr(PySpin, 'PixelFormat_' + pixel_format))
+        print('Pixel format set to %s...' % pixel_format)
+
+        # Allocate the frame ring up front so the grab loop never allocates frame memory
+        if ring_size:
+            ring = FrameRing(ring_size, cam.Height.GetValue(), cam.Width.GetValue(), frame_dtype(pixel_format))
+            print('Frame ring of %d x %s frames allocated...' % (ring.num_slots, ring.shape))
+
+        if (dark_subtraction or record_dark) and ring is None:
+            print('Dark frames need the frame ring. Aborting...')
+            return False
+        if record_dark:
+            # preallocated so collecting the darks costs the grab loop one copy per frame
+            dark_stack = np.empty((record_dark,) + ring.shape, dtype=ring.frames.dtype)
+            print('Recording %d frames for a master dark...' % record_dark)
+
+        if frame_stats:
+            statistics = FrameStatistics(cam.Height.GetValue(), cam.Width.GetValue(), bit_depth(pixel_format))
+
+        # Live frame channel for the viewer
+        if shared_frames:
+            live = SharedFrameRing(shared_frames, SHARED_FRAME_SLOTS, cam.Height.GetValue(), cam.Width.GetValue(),
+                                   create=True)
+            print('Publishing live frames to shared memory %s...' % shared_frames)
+
         # Set acquisition mode to continuous
         if cam.AcquisitionMode.GetAccessMode() != PySpin.RW:
             print('Unable to set acquisition mode to continuous. Aborting...')
@@ -166,8 +588,23 @@ def acquire_images(cam, twd, file_extension):
         cam.AcquisitionMode.SetValue(PySpin.AcquisitionMode_Continuous)
         print('Acquisition mode set to continuous...')
 
+        # Have Spinnaker push images to us as they arrive
+        if event_driven:
+            handler = FrameEventHandler(ring, pixel_format)
+            cam.RegisterEventHandler(handler)
+            threading.Thread(target=_wait_for_stop, args=(stop_event, handler), daemon=True).start()
+            print('Image event handler registered...')
+
+        # Wait for the other cameras so the first trigger is caught by all of them
+        if start_barrier is not None:
+            try:
+                start_barrier.wait(CAMERA_START_TIMEOUT)
+            except threading.BrokenBarrierError:
+                print('Not all cameras came up, starting anyway...')
+
         #  Begin acquiring images
         cam.BeginAcquisition()
+        started = time.perf_counter()
 
         print('Acquiring images...')
 
@@ -178,60 +615,212 @@ def acquire_images(cam, twd, file_extension):
 
             print('Device serial number retrieved as %s...' % device_serial_number)
 
+        # Master dark for these camera settings
+        if dark_subtraction or record_dark:
+            darks = DarkLibrary()
+            dark_name = dark_key(device_serial_number, pixel_format, geometry or capture_geometry(cam),
+                                 cam.ExposureTime.GetValue(), cam.Gain.GetValue())
+            if dark_subtraction and not record_dark:
+                dark = darks.load(dark_name)
+                if dark is None or dark.shape != ring.shape or dark.dtype != ring.frames.dtype:
+                    print('WARNING: no master dark %s, frames will not be dark subtracted' % dark_name)
+                    dark_name = ''
+                else:
+                    subtractor = DarkSubtractor(dark)
+                    # the ring slots hold the raw frames that get saved, the subtracted preview goes here
+                    dark_buffer = np.empty_like(dark)
+                    print('Subtracting master dark %s from live frames...' % dark_name)
+
+        # One run file for everything captured from here on
+        if file_extension == RUN_FILE_EXTENSION and not record_dark:
+            runfile = RunFileWriter(run_filename(twd, device_serial_number), cam.Height.GetValue(),
+                                    cam.Width.GetValue(), dtype=frame_dtype(pixel_format),
+                                    compression=RUN_FILE_COMPRESSION,
+                                    attrs=dict(geometry or {}, serial=device_serial_number, first_shot=shot_num,
+                                               pixel_format=pixel_format, bit_depth=bit_depth(pixel_format),
+                                               dark_frame=dark_name))
+            print('Appending shots to run file %s...' % runfile.filename)
+
+        # Per frame metadata log for this run
+        log_name = 'framelog-%s%s' % (device_serial_number + '-' if device_serial_number else '',
+                                      time.strftime('%Y%m%d-%H%M%S', time.localtime()))
+        log_dir = os.path.join(twd, MANIFEST_DIR, log_name)
+        # a run restarted within the same second gets its own log instead of appending to the last one
+        n = 2
+        while os.path.exists(log_dir):
+            log_dir = os.path.join(twd, MANIFEST_DIR, '%s-%d' % (log_name, n))
+            n += 1
+        framelog = FrameLog(log_dir,
+                            attrs=dict(geometry or {}, serial=device_serial_number, first_shot=shot_num,
+                                       file_extension=file_extension, pixel_format=pixel_format,
+                                       bit_depth=bit_depth(pixel_format), dark_frame=dark_name))
+        print('Logging frame metadata to %s...' % framelog.directory)
+
+        # Record the configuration this run actually used. The camera is already acquiring, so this
+        # doesn't hold up the first frame.
+        if snapshot is not None:
+            snapshot.refresh()
+            snapshot.save(os.path.join(framelog.directory, 'camera_config.txt'),
+                          'Camera %s configuration for this run' % device_serial_number)
+
         # get ith number and save
         # Retrieve, convert, and save images
         while True:
             try:
-                if keyboard.is_pressed('esc'):
-                    break
                 #  Retrieve the next image from the trigger
                 # result &= grab_next_image_by_trigger(cam)
 
-                #  Retrieve next received image
-                image_result = cam.GetNextImage(100)
+                if handler is not None:
+                    # Sleep until the event handler hands us an image or we're told to stop
+                    grab = handler.frames.get()
+                    if grab is None:
+                        break
+                else:
+                    if _stop_requested(stop_event):
+                        break
+                    #  Retrieve next received image
+                    try:
+                        image_result = cam.GetNextImage(GRAB_TIMEOUT)
+                    except PySpin.SpinnakerException:
+                        # no trigger within the timeout
+                        continue
+                    # errors copying or converting the image are real errors, reported below
+                    grab = grab_frame(image_result, ring, pixel_format=pixel_format)
 
                 #  Ensure image completion
-                if image_result.IsIncomplete():
-                    print('Image incomplete with image status %d ...' % image_result.GetImageStatus())
-
+                if grab.status:
+                    print('Image incomplete with image status %d ...' % grab.status)
+                    incomplete += 1
+                    _log_frame(framelog, -1, grab, grab.status)
+                    continue
+
+                if grab.overrun:
+                    print('Frame ring overrun, dropped shot %d!' % shot_num)
+                    overruns += 1
+                    _log_frame(framelog, shot_num, grab, DROPPED_RING)
+                    shot_num += 1
+                    continue
+                grabbed += 1
+
+                # Collect darks instead of saving shots
+                if dark_stack is not None:
+                    dark_stack[dark_count] = grab.frame
+                    ring.release(grab.slot)
+                    _log_frame(framelog, -1, grab, 0)
+                    dark_count += 1
+                    if dark_count == record_dark:
+                        break
+                    continue
+
+                # Quick look statistics of the raw frame, read straight from the ring slot or Spinnaker image
+                image_stats = None
+                if statistics is not None:
+                    t = time.perf_counter()
+                    image_stats = statistics.compute(grab.frame if grab.frame is not None
+                                                     else grab.image.GetNDArray())
+                    stats_times.append(time.perf_counter() - t)
+                row = _log_frame(framelog, shot_num, grab, 0, image_stats)
+
+                #  Print image information
+                print('Grabbed Image %d, width = %d, height = %d' % (shot_num, grab.width, grab.height))
+                if image_stats is not None:
+                    print(format_stats(image_stats))
+
+                # Create a unique filename
+                if runfile is not None:
+                    filename = '%s#%d' % (runfile.filename, shot_num)
+                elif device_serial_number:
+                    filename = os.path.join(twd, 'Shot-%s-%d.%s' % (device_serial_number, shot_num, file_extension))
+                else:  # if serial number is empty
+                    filename = os.path.join(twd, 'Shot-%d.%s' % (shot_num, file_extension))
+
+                if grab.frame is not None:
+                    frame = grab.frame
+                    if live is not None:
+                        preview = frame if subtractor is None else subtractor.apply(frame, out=dark_buffer)
+                        live.publish(preview, shot_num, preview_shift(pixel_format), image_stats)
+
+                    # Queue a view of the ring slot for saving. The writer frees the slot once it is on disk
+                    if runfile is not None:
+                        save = lambda fn, frame=frame, shot=shot_num: runfile.append(frame, shot)
+                    elif WRITE_THUMBNAILS:
+                        save = lambda fn, frame=frame: _save_with_thumbnail(frame, fn, bit_depth(pixel_format))
+                    else:
+                        save = lambda fn, frame=frame: save_frame(frame, fn)
+                    queued = writer.submit(_recorded(save, shot_num, framelog, row), filename,
+                                           done=lambda idx=grab.slot: ring.release(idx), grabbed=grab.host_time)
+                    if not queued:
+                        ring.release(grab.slot)
                 else:
+                    image_converted = grab.image
+                    if live is not None:
+                        live.publish(image_converted.GetNDArray(), shot_num, stats=image_stats)
+
+                    # Queue image for saving by the writer pool
+                    if runfile is not None:
+                        save = lambda fn, img=image_converted, shot=shot_num: runfile.append(img.GetNDArray(), shot)
+                    else:
+                        save = image_converted.Save
+                    queued = writer.submit(_recorded(save, shot_num, framelog, row), filename, grabbed=grab.host_time)
+
+                if queued:
+                    print('Image queued for %s\n' % filename)
+                else:
+                    print('Writer queue full, dropped shot %d!' % shot_num)
+                    framelog.set_status(row, DROPPED_WRITER)
+                # don't need this bit below as it'll be handled by a separate process!
+                # img = imgViewer(filename)
+                # img = mp.Process(target=imgViewer, args=(filename,))
+                # img.start()
 
-                    #  Print image information
-                    width = image_result.GetWidth()
-                    height = image_result.GetHeight()
-                    print('Grabbed Image %d, width = %d, height = %d' % (shot_num, width, height))
-
-                    #  Convert image to mono 8
-                    image_converted = image_result.Convert(PySpin.PixelFormat_Mono8, PySpin.HQ_LINEAR)
-
-                    # Create a unique filename
-                    if device_serial_number:
-                        filename = os.path.join(twd, 'Shot-%s-%d.%s' % (device_serial_number, shot_num, file_extension))
-                    else:  # if serial number is empty
-                        filename = os.path.join(twd, 'Shot-%d.%s' % (shot_num, file_extension))
-
-                    # Save image
-                    image_converted.Save(filename)
-                    # don't need this bit below as it'll be handled by a separate process!
-                    # img = imgViewer(filename)
-                    # img = mp.Process(target=imgViewer, args=(filename,))
-                    # img.start()
-
-                    print('Image saved at %s\n' % filename)
-
-                    #  Release image
-                    image_result.Release()
-                    shot_num += 1
+                shot_num += 1
+                if shot_num % WRITER_REPORT_INTERVAL == 0 or writer.falling_behind():
+                    print('Writer stats: %s' % writer.stats())
 
             except PySpin.SpinnakerException as ex:
-                pass
+                print('Error grabbing image: %s' % ex)
 
         # End acquisition
         cam.EndAcquisition()
 
+        if dark_stack is not None and dark_count:
+            path = darks.save(dark_name, build_master_dark(dark_stack[:dark_count], DARK_METHOD))
+            print('Master dark of %d frames saved to %s' % (dark_count, path))
+
     except PySpin.SpinnakerException as ex:
         print('Error in acquire_images: %s' % ex)
 
+    finally:
+        if handler is not None:
+            try:
+                cam.UnregisterEventHandler(handler)
+            except PySpin.SpinnakerException as ex:
+                print('Error unregistering image event handler: %s' % ex)
+        # make sure everything grabbed makes it to disk
+        writer.close()
+        print('Writer stats: %s' % writer.stats())
+        if ring is not None:
+            print('Frame ring: %d frames stored, %d overruns' % (ring.stored, ring.overruns))
+        if stats_times:
+            print('Frame statistics: %.2f ms median, %.2f ms p99 per frame'
+                  % tuple(1000 * np.percentile(stats_times, (50, 99))))
+        if live is not None:
+            live.close()
+        if runfile is not None:
+            runfile.close()
+        if framelog is not None:
+            framelog.close()
+            print('Frame log: %s' % framelog.summary())
+        if stats is not None:
+            stats.update(writer.stats())
+            stats.update({'grabbed': grabbed, 'incomplete': incomplete, 'ring_overruns': overruns,
+                          'elapsed': time.perf_counter() - started if started else 0.,
+                          'latency': writer.latency_percentiles()})
+            if framelog is not None:
+                stats['frame_log'] = framelog.summary()
+            if stats_times:
+                stats['frame_stats_time'] = dict(zip((50, 99), np.percentile(stats_times, (50, 99))))
+
     return result
 
 
@@ -299,13 +888,45 @@ def print_device_info(nodemap):
     return result
 
 
-def run_single_camera(cam, twd, file_extension):
+def configure_camera(nodemap, config=CAMERA_CONFIG):
+    """
+    Brings the camera to the settings in a config file. The camera's current values are read in one
+    pass and only the nodes that differ get written.
+
+    :param nodemap: GenICam nodemap of the initialized camera
+    :param config: Config file of 'Node Name: value' lines, or None to write nothing
+    :return: NodeSnapshot of the config nodes, RECORDED_NODES and the ones set by this module, or None on
+             failure
+    """
+    print('*** APPLYING CAMERA CONFIGURATION ***\n')
+    st = time.perf_counter()
+    desired = {}
+    if config:
+        try:
+            desired = load_node_config(config)
+        except OSError as e:
+            print('Could not read camera config %s: %s' % (config, e))
+    desired = {k: v for k, v in desired.items() if k not in CONFIG_OWNED_NODES}
+    try:
+        snapshot = NodeSnapshot(PySpin, nodemap, list(desired) + list(RECORDED_NODES) + list(CONFIG_OWNED_NODES))
+        written, skipped = snapshot.apply(desired)
+    except PySpin.SpinnakerException as ex:
+        print('Error in configure_camera: %s' % ex)
+        return None
+    print('Camera configuration: %d nodes checked, %d written (%s), %d not settable, %.0f ms' % (
+        len(desired), len(written), ', '.join(written) or 'none', len(skipped), 1000 * (time.perf_counter() - st)))
+    return snapshot
+
+
+def run_single_camera(cam, twd, file_extension, capture_profile=CAPTURE_PROFILE, **kwargs):
     """
     This function acts as the body of the example; please see NodeMapInfo example
     for more in-depth comments on setting up cameras.
 
     :param cam: Camera to run on.
     :type cam: CameraPtr
+    :param capture_profile: Name of the sensor readout profile in CAPTURE_PROFILES
+    :param kwargs: Acquisition options passed on to acquire_images
     :return: True if successful, False otherwise.
     :rtype: bool
     """
@@ -324,12 +945,23 @@ def run_single_camera(cam, twd, file_extension):
         # Retrieve GenICam nodemap
         nodemap = cam.GetNodeMap()
 
+        # Apply the camera configuration file if one is set, writing only what changed. Either way the snapshot
+        # records the settings this run uses
+        snapshot = configure_camera(nodemap)
+        if snapshot is None:
+            return False
+
         # Configure trigger
         if configure_trigger(cam) is False:
             return False
 
+        # Configure ROI, binning and decimation
+        geometry = configure_capture_profile(cam, capture_profile)
+        if geometry is None:
+            return False
+
         # Acquire images
-        result &= acquire_images(cam, twd, file_extension)
+        result &= acquire_images(cam, twd, file_extension, geometry=geometry, snapshot=snapshot, **kwargs)
 
         # Reset trigger
         result &= reset_trigger(cam)
@@ -344,27 +976,96 @@ def run_single_camera(cam, twd, file_extension):
     return result
 
 
-def set_directory(twd, file_extension):
+def set_directory(twd, file_extension, tag=''):
+    """
+    Creates the image directory if needed and picks up the shot numbering where the last run left off.
+
+    :param twd: Image directory
+    :param file_extension: Extension shots are saved with
+    :param tag: Serial number of the camera, which keeps its own shot counter. The same camera has to use the
+                same counter whether it runs alone or with others, as its files are named the same either way.
+    :return: None
+    """
     global shot_num
+    global shot_manifest
     if not os.path.exists(twd):
-        os.mkdir(twd)
-        shot_num = 1
+        os.makedirs(twd, exist_ok=True)
     else:
-        print('Images Directory found - Parsing for images')
-        if [i for i in os.listdir(twd) if i[-3:] == file_extension]:
-            present_shots = [int(i[:-4].split('-')[-1]) for i in os.listdir(twd) if i[-3:] == file_extension]
-            shot_num = max(present_shots) + 1
-        else:
-            shot_num = 1
+        print('Images Directory found - Reading shot manifest')
+    # the manifest keeps the next shot number, so we don't have to parse every file in the directory
+    shot_manifest = ShotManifest(twd, file_extension, tag)
+    shot_num = shot_manifest.next_shot
 
     print('Shot num: ', shot_num)
 
 
-def main(directory, file_extension):
+def _camera_serials(cam_list):
+    """
+    :param cam_list: CameraList from the system
+    :return: Serial numbers of the cameras in the list, read from the TL device nodemap without initializing them
+    """
+    serials = []
+    for cam in cam_list:
+        serials.append(cam.TLDevice.DeviceSerialNumber.GetValue())
+        del cam
+    return serials
+
+
+def run_camera_process(serial, index, twd, file_extension, start_barrier, results, kwargs):
+    """
+    Body of a per camera process. Opens its own Spinnaker system, picks its camera by serial number and
+    acquires until the shared stop event is set.
+
+    :param serial: Serial number of the camera to run
+    :param index: Position of the camera in the system's camera list. Camera 0 publishes live frames under the
+                  plain shared memory name, the others under '<name>-<serial>'.
+    :param twd: Image directory
+    :param file_extension: Image format to save as
+    :param start_barrier: multiprocessing Barrier shared by all camera processes
+    :param results: multiprocessing Queue receiving (serial, result, stats) when the camera is done
+    :param kwargs: Acquisition options for acquire_images. stats is replaced by a per camera dict.
+    :return: None
+    """
+    kwargs = dict(kwargs)
+    stats = {}
+    kwargs['stats'] = stats
+    if index and kwargs.get('shared_frames'):
+        kwargs['shared_frames'] = '%s-%s' % (kwargs['shared_frames'], serial)
+    result = False
+    system = PySpin.System.GetInstance()
+    cam_list = system.GetCameras()
+    try:
+        set_directory(twd, file_extension, tag=serial)
+        cam = cam_list.GetBySerial(serial)
+        result = run_single_camera(cam, twd, file_extension, start_barrier=start_barrier, **kwargs)
+        del cam
+        shot_manifest.close()
+    except PySpin.SpinnakerException as ex:
+        print('Error on camera %s: %s' % (serial, ex))
+    finally:
+        # don't leave the other cameras waiting if this one never got to the barrier
+        start_barrier.abort()
+        cam_list.Clear()
+        system.ReleaseInstance()
+        results.put((serial, result, stats))
+
+
+def main(directory, file_extension, **kwargs):
     """
     Example entry point; please see Enumeration example for more in-depth
     comments on preparing and cleaning up the system.
 
+    A single camera is run in this process. With several cameras connected each one
+    gets its own process, writers and shot counter, and all of them stop on the same
+    stop_event.
+
+    :param directory: Directory to save images to
+    :param file_extension: Image format to save as, e.g. 'png'
+    :param kwargs: Acquisition options passed on to acquire_images (num_writers, writer_queue_size, ring_size,
+                   shared_frames, event_driven, stop_event, stats, pixel_format, frame_stats, dark_subtraction,
+                   record_dark) and capture_profile for
+                   run_single_camera. With several cameras stats is
+                   filled with one dict per serial number.
     :return: True if successful, False otherwise.
     :rtype: bool
     """
@@ -372,7 +1073,6 @@ def main(directory, file_extension):
 
     twd = directory
     # twd = os.path.join(owd, 'Images')
-    set_directory(twd, file_extension)
     result = True
 
     # Retrieve singleton reference to system object
@@ -395,21 +1095,52 @@ def main(directory, file_extension):
         input('Done! Press Enter to exit...')
         return False
 
-    # Run example on each camera
-    for cam in cam_list:
-        result &= run_single_camera(cam, twd, file_extension)
+    if num_cameras == 1:
+        # counter keyed by serial number, the same one this camera uses when running alongside others
+        set_directory(twd, file_extension, tag=_camera_serials(cam_list)[0])
+        for cam in cam_list:
+            result &= run_single_camera(cam, twd, file_extension, **kwargs)
 
-    # Release reference to camera
-    # NOTE: Unlike the C++ examples, we cannot rely on pointer objects being automatically
-    # cleaned up when going out of scope.
-    # The usage of del is preferred to assigning the variable to None.
-    del cam
+        # Release reference to camera
+        # NOTE: Unlike the C++ examples, we cannot rely on pointer objects being automatically
+        # cleaned up when going out of scope.
+        # The usage of del is preferred to assigning the variable to None.
+        del cam
 
-    # Clear camera list before releasing system
-    cam_list.Clear()
+        # Clear camera list before releasing system
+        cam_list.Clear()
+
+        # Release system instance
+        system.ReleaseInstance()
+        shot_manifest.close()
+        print('Done!')
+        return result
 
-    # Release system instance
+    # Several cameras: hand each one to its own process. The system is released first so the
+    # processes can open the cameras themselves.
+    serials = _camera_serials(cam_list)
+    cam_list.Clear()
     system.ReleaseInstance()
+    if not os.path.exists(twd):
+        os.makedirs(twd, exist_ok=True)
+    print('Running %d cameras in parallel: %s' % (len(serials), ', '.join(serials)))
+
+    stats = kwargs.pop('stats', None)
+    start_barrier = mp.Barrier(len(serials))
+    results = mp.Queue()
+    processes = [mp.Process(target=run_camera_process,
+                            args=(serial, i, twd, file_extension, start_barrier, results, kwargs))
+                 for i, serial in enumerate(serials)]
+    for p in processes:
+        p.start()
+    # collect before joining, a process can't exit while its result is stuck in the queue
+    for _ in processes:
+        serial, camera_result, camera_stats = results.get()
+        result &= camera_result
+        if stats is not None:
+            stats[serial] = camera_stats
+    for p in processes:
+        p.join()
     print('Done!')
     return result
 
@@ -0,0 +1,114 @@
+import os
+import numpy as np
+
+# master darks are kept with the camera config, they outlive any one image directory
+DARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Config', 'darks')
+# exposure (us) and gain (dB) are rounded to this before being used as a key, the camera reports them as floats
+EXPOSURE_STEP = 1.
+GAIN_STEP = 0.1
+
+
+def dark_key(serial, pixel_format, geometry, exposure, gain):
+    """
+    Builds the key a master dark is stored under. A dark only fits frames taken with the same camera,
+    pixel format, readout geometry, exposure and gain.
+
+    :param serial: Camera serial number
+    :param pixel_format: Pixel format name, e.g. 'Mono12p'
+    :param geometry: dict from CamCapture.capture_geometry (width, height, offsets, binning, decimation)
+    :param exposure: Exposure time in us
+    :param gain: Gain in dB
+    :return: Key string, usable as a file name
+    """
+    g = geometry or {}
+    return 'dark-%s-%s-%dx%d+%d+%d-b%dx%d-d%dx%d-e%d-g%.1f' % (
+        serial or 'unknown', pixel_format, g.get('width', 0), g.get('height', 0), g.get('offset_x', 0),
+        g.get('offset_y', 0), g.get('binning_h', 1), g.get('binning_v', 1), g.get('decimation_h', 1),
+        g.get('decimation_v', 1), round(exposure / EXPOSURE_STEP) * EXPOSURE_STEP,
+        round(gain / GAIN_STEP) * GAIN_STEP)
+
+
+def build_master_dark(frames, method='median'):
+    """
+    Combines a stack of dark or background frames into one master frame
+
+    :param frames: (n, height, width) array of frames
+    :param method: 'median' (robust against cosmic rays and stray light) or 'mean'
+    :return: (height, width) master frame, same dtype as the input
+    """
+    if method == 'median':
+        master = np.median(frames, axis=0)
+    elif method == 'mean':
+        master = frames.mean(axis=0, dtype=np.float64)
+    else:
+        raise ValueError('Unknown master dark method %s' % method)
+    return np.rint(master).astype(frames.dtype)
+
+
+class DarkLibrary:
+    """
+    On disk cache of master darks, one .npy per dark_key, with the loaded ones kept in memory.
+    """
+    def __init__(self, directory=DARK_DIR):
+        """
+        :param directory: Directory holding the darks. Created when the first dark is saved.
+        """
+        self.directory = directory
+        self.cache = {}
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def load(self, key):
+        """
+        :param key: Key from dark_key
+        :return: Master dark array, or None if there isn't one for this key
+        """
+        if key not in self.cache:
+            try:
+                self.cache[key] = np.load(self.path(key))
+            except (OSError, ValueError):
+                return None
+        return self.cache[key]
+
+    def save(self, key, dark):
+        """
+        Stores a master dark, replacing any previous one with the same key
+
+        :param key: Key from dark_key
+        :param dark: Master dark array
+        :return: Path the dark was written to
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp = path + '.tmp.npy'
+        np.save(tmp, dark)
+        os.replace(tmp, path)
+        self.cache[key] = dark
+        return path
+
+
+class DarkSubtractor:
+    """
+    Subtracts a master dark from frames, clipping at zero, without allocating anything per frame.
+    """
+    def __init__(self, dark):
+        """
+        :param dark: Master dark, at least as large as the frames it will be applied to
+        """
+        self.dark = dark
+
+    def apply(self, frame, out=None):
+        """
+        :param frame: 2D array of the same dtype as the dark
+        :param out: Preallocated array at least as large as the frame to write the result into. None modifies
+                    the frame in place.
+        :return: The dark subtracted frame, a view of out if given
+        """
+        h, w = frame.shape
+        dark = self.dark[:h, :w]
+        out = frame if out is None else out[:h, :w]
+        # raise everything below the dark up to it first, so the unsigned subtraction can't wrap
+        np.maximum(frame, dark, out=out)
+        np.subtract(out, dark, out=out)
+        return out
@@ -0,0 +1,84 @@
+import numpy as np
+
+# Spectra with more points than this per pixel column of the plot are drawn as a min/max envelope
+DECIMATE_ABOVE = 2
+# Plot width assumed before the axes have been laid out
+DEFAULT_COLUMNS = 800
+
+
+def minmax_envelope(x, y, x0, x1, columns):
+    """
+    Reduces a series to the minimum and maximum of each pixel column between x0 and x1. Every peak still reaches
+    its full height however narrow it is, which plain subsampling can't promise, and the result is at most
+    2 * columns points no matter how long the series is.
+
+    :param x: 1D array, sorted ascending
+    :param y: 1D array of the same length
+    :param x0: Left edge of the visible range
+    :param x1: Right edge of the visible range
+    :param columns: Pixel columns across the visible range
+    :return: (x, y) arrays to plot. The visible part of the series as is if it is short enough already.
+    """
+    # one point either side of the view, so the line runs off the edges instead of stopping short
+    lo = int(np.searchsorted(x, x0, 'left'))
+    hi = int(np.searchsorted(x, x1, 'right'))
+    before = slice(max(lo - 1, 0), lo)
+    after = slice(hi, min(hi + 1, len(x)))
+    columns = max(1, int(columns))
+    if hi - lo <= DECIMATE_ABOVE * columns:
+        return x[before.start:after.stop], y[before.start:after.stop]
+    xv = x[lo:hi]
+    yv = y[lo:hi]
+    # first point of every column, columns without points dropped
+    starts = np.unique(np.searchsorted(xv, np.linspace(x0, x1, columns + 1)[:-1]))
+    starts = starts[starts < len(xv)]
+    xd = np.repeat(xv[starts], 2)
+    yd = np.empty(len(xd), dtype=np.result_type(y, np.float64))
+    yd[0::2] = np.minimum.reduceat(yv, starts)
+    yd[1::2] = np.maximum.reduceat(yv, starts)
+    return np.concatenate((x[before], xd, x[after])), np.concatenate((y[before], yd, y[after]))
+
+
+class DecimatedLine:
+    """
+    Shows a long series on a matplotlib Line2D as a min/max envelope sized to
+    the axes' pixel width. It is re-decimated whenever the x limits change
+    (zoom, pan) or the axes are resized, so drawing costs the same for a 2k or a
+    200k point spectrum while narrow emission lines stay visible.
+    """
+    def __init__(self, line):
+        """
+        :param line: Line2D to draw into. Its axes must not be None.
+        """
+        self.line = line
+        self.ax = line.axes
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.columns = None
+        self.ax.callbacks.connect('xlim_changed', lambda ax: self.refresh())
+        self.ax.figure.canvas.mpl_connect('resize_event', lambda event: self.refresh())
+
+    def set_data(self, x, y):
+        """
+        :param x: 1D array of x values
+        :param y: 1D array of y values
+        :return: None
+        """
+        x = np.asarray(x)
+        y = np.asarray(y)
+        if len(x) > 1 and np.any(x[1:] < x[:-1]):
+            order = np.argsort(x, kind='stable')
+            x, y = x[order], y[order]
+        self.x, self.y = x, y
+        self.refresh()
+
+    def refresh(self):
+        """
+        Re-decimates for the current view
+
+        :return: None
+        """
+        x0, x1 = sorted(self.ax.get_xlim())
+        width = self.ax.bbox.width
+        self.columns = int(width) if width > 1 else DEFAULT_COLUMNS
+        self.line.set_data(*minmax_envelope(self.x, self.y, x0, x1, self.columns))
@@ -0,0 +1,195 @@
+import os
+import stat
+import time
+import queue
+import bisect
+import threading
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# directory mtimes are coarse on some filesystems, so a directory changed this recently is always rescanned
+MTIME_SLACK = 2.
+
+
+class _EventQueue(FileSystemEventHandler):
+    """
+    Hands filesystem notifications from the watchdog thread to whoever calls DirectoryIndex.refresh
+    """
+    def __init__(self):
+        super().__init__()
+        self.events = queue.Queue()
+
+    def on_any_event(self, event):
+        if not event.is_directory:
+            self.events.put((event.event_type, event.src_path, getattr(event, 'dest_path', None)))
+
+
+class DirectoryIndex:
+    """
+    Keeps the files of one directory ordered by modification time, updated
+    incrementally so the viewer never relists and stats the whole directory.
+
+    With watchdog installed (inotify on Linux, ReadDirectoryChangesW on
+    Windows) refresh() only handles the files that changed since the last
+    call. Without it refresh() falls back to polling. The directory's own
+    mtime is checked first, so an unchanged directory costs a single stat.
+    Otherwise one scandir pass runs, and only files that weren't seen
+    before get stat'ed.
+
+    Hidden files and subdirectories (like the .libsgui sidecar directory) are ignored.
+    """
+    def __init__(self, directory, use_watchdog=True):
+        """
+        :param directory: Directory to index
+        :param use_watchdog: Use filesystem notifications when watchdog is available, polling otherwise
+        """
+        self.directory = directory
+        self.mtimes = {}
+        self.order = []  # sorted (mtime, name)
+        self.changed = {}  # name -> new mtime, or None if it went away, since the last changes() call
+        self.dir_mtime = None
+        self.scanned_at = 0.
+        self.observer = None
+        self.handler = None
+        self.lock = threading.Lock()
+        if use_watchdog and Observer is not None:
+            self.handler = _EventQueue()
+            self.observer = Observer()
+            self.observer.schedule(self.handler, directory, recursive=False)
+            self.observer.daemon = True
+            self.observer.start()
+        # the initial listing is needed in both modes, events only cover what happens from here on
+        self._scan()
+
+    def _add(self, name, mtime):
+        old = self.mtimes.get(name)
+        if old == mtime:
+            return
+        if old is not None:
+            self._remove(name)
+        self.mtimes[name] = mtime
+        bisect.insort(self.order, (mtime, name))
+        self.changed[name] = mtime
+
+    def _remove(self, name):
+        mtime = self.mtimes.pop(name, None)
+        if mtime is None:
+            return
+        self.changed[name] = None
+        i = bisect.bisect_left(self.order, (mtime, name))
+        if i < len(self.order) and self.order[i] == (mtime, name):
+            del self.order[i]
+
+    def _stat(self, name):
+        """
+        :return: mtime of a file in the directory, or None if it isn't a regular file (anymore)
+        """
+        try:
+            st = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return None
+        return st.st_mtime if stat.S_ISREG(st.st_mode) else None
+
+    def _scan(self):
+        """
+        Polling refresh: lists the directory and stats only the new files
+
+        :return: None
+        """
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime
+        except OSError:
+            return
+        now = time.time()
+        if dir_mtime == self.dir_mtime and self.scanned_at - dir_mtime > MTIME_SLACK:
+            return
+        self.dir_mtime = dir_mtime
+        self.scanned_at = now
+        seen = set()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                seen.add(entry.name)
+                if entry.name in self.mtimes:
+                    continue
+                try:
+                    if entry.is_file():
+                        self._add(entry.name, entry.stat().st_mtime)
+                except OSError:
+                    pass
+        for name in [n for n in self.mtimes if n not in seen]:
+            self._remove(name)
+
+    def _drain(self):
+        """
+        Notification refresh: applies the queued filesystem events
+
+        :return: None
+        """
+        while True:
+            try:
+                kind, src, dest = self.handler.events.get_nowait()
+            except queue.Empty:
+                return
+            for path, gone in ((src, kind in ('deleted', 'moved')), (dest, False)):
+                if not path or os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.directory):
+                    continue
+                name = os.path.basename(path)
+                if name.startswith('.'):
+                    continue
+                mtime = None if gone else self._stat(name)
+                if mtime is None:
+                    self._remove(name)
+                else:
+                    self._add(name, mtime)
+
+    def refresh(self):
+        """
+        Brings the index up to date
+
+        :return: None
+        """
+        with self.lock:
+            if self.observer is not None:
+                self._drain()
+            else:
+                self._scan()
+
+    def newest(self, n=None):
+        """
+        :param n: Number of files to return, None for all
+        :return: Full paths of the n most recently modified files, oldest first
+        """
+        with self.lock:
+            items = self.order if n is None else self.order[-n:]
+            return [os.path.join(self.directory, name) for mtime, name in items]
+
+    def changes(self):
+        """
+        Files added, modified or removed since the last call (the first call returns the whole directory), for
+        consumers that keep their own index up to date incrementally
+
+        :return: dict of full path to new mtime, None for removed files
+        """
+        with self.lock:
+            changed, self.changed = self.changed, {}
+        return {os.path.join(self.directory, name): mtime for name, mtime in changed.items()}
+
+    def __len__(self):
+        return len(self.order)
+
+    def close(self):
+        """
+        Stops watching the directory
+
+        :return: None
+        """
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join(1.)
+            self.observer = None
@@ -1,11 +1,14 @@
 import tkinter as tk
 from tkinter import font, ttk
 import os
-from PIL import ImageTk, Image
+from PIL import ImageTk
 import matplotlib.pyplot as plt
 import numpy as np
 import time
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from ThumbnailCache import ThumbnailCache, load_preview
+from ViewerWorker import ViewerWorker
+from Decimation import DecimatedLine
 
 
 class imageViewer:
@@ -18,8 +21,9 @@ class imageViewer:
     # Year:     2021
     # Version:  V.1.0.0
     """
-    def __init__(self, image_target_dir, spectra_target_dir, file_extension, master=None):
+    def __init__(self, image_target_dir, spectra_target_dir, file_extension, master=None, shared_frames=None):
         # self.window = tk.Tk(className='\Image Viewer')
+        # rows of widgets (image + spectrum figure) reused for whichever shots are scrolled into view
         self.num_of_images = 5
         # self.iter = 1
         # instatiate master window
@@ -36,11 +40,12 @@ class imageViewer:
         # breaks .grid layout. WTF
         # self.canvas.bind('<Configure>', self.resize_canvas)
 
-        self.scrollbar = ttk.Scrollbar(master=self.window, orient='vertical', command=self.canvas.yview)
+        # the scrollbar spans every shot of the run, while only the num_of_images rows below exist. Scrolling
+        # moves those rows on to the shots in view, see scroll_history
+        self.scrollbar = ttk.Scrollbar(master=self.window, orient='vertical', command=self._on_scroll)
         self.scrollFrame = ttk.Frame(master=self.canvas)
         self.scrollFrame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox('all')))
         self.canvas.create_window((0, 0), window=self.scrollFrame, anchor='nw')
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
 
         # initialize lists to store entities later on so that we are nice to the RAM
         self.list_of_rtnframe = []
@@ -54,6 +59,7 @@ class imageViewer:
         self.list_of_spectra_plot_ax = []
         self.list_of_spectra_plot_lineplot = []
         self.list_of_spectra_plot_ax_line = []
+        self.list_of_spectra_decimated = []
 
         # stuff for the image frames
         font = tk.font.Font(family='Helvetica', size=16, weight='bold')
@@ -71,14 +77,35 @@ class imageViewer:
             self.list_of_spectra_plot_lineplot.append(
                 FigureCanvasTkAgg(self.list_of_spectra_plots[i], self.list_of_specframe[i]))
 
-        # initialize plots so that we can update them later
+        # initialize plots so that we can update them later. Axes, ticks and labels are drawn once and cached
+        # as a background; only the line and title are animated and blitted on top of it for each new shot
+        self.list_of_spectra_titles = []
+        self.list_of_spectra_backgrounds = [None] * self.num_of_images
+        self.shown_spectra = [None] * self.num_of_images
+        self.shown_spectra_data = [None] * self.num_of_images
+        self.shown_spectra_lines = [None] * self.num_of_images
         for i in range(self.num_of_images):
-            self.list_of_spectra_plot_ax_line.append(self.list_of_spectra_plot_ax[i].plot(0, 0, linewidth=0.65))
+            ax = self.list_of_spectra_plot_ax[i]
+            ax.set_xlim([200, 1000])
+            ax.set_ylim([0, 1])
+            ax.set_xlabel('Wavelength(nm)')
+            ax.set_ylabel('Intensity')
+            self.list_of_spectra_plot_ax_line.append(ax.plot([], [], linewidth=0.35, animated=True)[0])
+            # long spectra are drawn as a min/max envelope of the plot's pixel columns
+            self.list_of_spectra_decimated.append(DecimatedLine(self.list_of_spectra_plot_ax_line[i]))
+            self.list_of_spectra_titles.append(ax.set_title('', animated=True))
+            self.list_of_spectra_plot_lineplot[i].mpl_connect('draw_event', lambda event, j=i: self._on_draw(j))
+            # click a spectrum to zoom into it
+            self.list_of_spectra_plot_lineplot[i].mpl_connect('button_press_event',
+                                                              lambda event, j=i: self.zoom_spectrum(j))
         # grid ALL the things!
         for i in range(self.num_of_images):
             self.list_of_spectra_headers[i].grid(row=1, column=0, columnspan=2)
             self.list_of_sample_header[i].grid(row=0, column=0, columnspan=2)
             self.list_of_sample_images_label[i].grid(row=1, column=0, columnspan=2)
+            # thumbnails are reduced decodes, click one to see the shot at full resolution
+            self.list_of_sample_images_label[i].bind('<Button-1>', lambda event, j=i: self.zoom(j))
+            self.list_of_spectra_plot_lineplot[i].get_tk_widget().grid(row=1, column=0, columnspan=2)
 
             # not sure about below. seems to work?
             self.list_of_imgframe[i].grid(row=0, column=1)
@@ -100,13 +127,34 @@ class imageViewer:
         self.img_dir_list = []
         self.spectra_dir_list = []
         self.iter = 0
+        # listing, decoding, resizing and spectrum parsing all happen in the worker, the Tk thread only shows
+        # its results. Live frames come straight from the camera process if it is publishing them
+        self.thumbnail_scale = 0.35
+        self.worker = ViewerWorker(self.image_target_dir, self.spectra_target_dir, self.num_of_images,
+                                   shared_frames=shared_frames, scale=self.thumbnail_scale,
+                                   file_extension=file_extension)
+        self.worker.start()
+        self.shown_generation = 0
+        self.closed = False
+        self.unmatched_text = ''
+        self.history_text = ''
+        # history position: pixels below the top of the newest shot, the shot shown in the first row, shots in total
+        self.history_y = 0.
+        self.history_first = 0
+        self.history_total = 0
+        # PhotoImages of the worker's thumbnails, so a new shot costs one conversion instead of num_of_images, and
+        # scrolling back over recent shots costs none
+        self.thumbnails = ThumbnailCache(8 * self.num_of_images)
 
         # kickstart directory polling
         self.pollDirectory()
+        self.drain_results()
         # run self.onClosing when we close the window to ensure proper cleanup
         self.window.protocol('WM_DELETE_WINDOW', self.onClosing)
-        # L O O P
-        self.window.mainloop()
+        # L O O P. Opened from the launcher, its mainloop already runs this window, and looping here too would keep
+        # the launcher's showImageViewer from ever returning
+        if master is None:
+            self.window.mainloop()
 
     def resize_canvas(self, event):
         """
@@ -120,32 +168,84 @@ class imageViewer:
 
     def pollDirectory(self):
         """
-        Polls target directories and pulls lists of files to pass to update_image
+        Asks the worker to check the target directories, its results are picked up by drain_results
 
         :return: None
         """
-        # Make sure cwd is the same as the target wd
-        if not os.getcwd() == self.image_target_dir:
-            os.chdir(self.image_target_dir)
-        try:
-            # get a lits of all files in image_directory
-            self.img_dir_list = sorted(filter(os.path.isfile, os.listdir('.')), key=os.path.getmtime)
-            # set current top image to the most recently modified file in the image_directory
-            if not self.current_display or self.current_display != self.img_dir_list[-1]:
-                self.current_display = self.img_dir_list[-1]
-            # change dir to spectra dir and get a list of present files
-            os.chdir(self.spectra_target_dir)
-            self.spectra_dir_list = sorted(filter(os.path.isfile, os.listdir('.')), key=os.path.getmtime)
-
-            # update images for your viewing pleasure
-            self.update_image(self.img_dir_list, self.spectra_dir_list)
+        self.worker.request()
+        self.update_time_label.config(text='LibsGUI v1.0.1 \nLast update time: ' + str(time.strftime("%H:%M:%S", time.localtime()))
+                                      + self.history_text + self.unmatched_text)
+        self.window.after(1000, self.pollDirectory)
+
+    def drain_results(self):
+        """
+        Shows the newest finished update from the worker, if there is one newer than what is on screen
 
+        :return: None
+        """
+        try:
+            update = self.worker.latest()
+            if update is not None and update.total != self.history_total:
+                grown = update.total - self.history_total
+                self.history_total = update.total
+                # while browsing the history, stay on the same shots as new ones come in above them
+                self.scroll_history(self.history_y + (grown * self._row_height() if self.history_y > 0 else 0))
+            # anything older than what's shown already, or for rows that have been scrolled away, is stale
+            if (update is not None and update.generation > self.shown_generation
+                    and update.first == self.history_first):
+                self.shown_generation = update.generation
+                self.update_image(update)
         except Exception as e:
             print(e)
         finally:
-            # ensure that running polldirectory takes <1000ms before changing!
-            self.update_time_label.config(text='LibsGUI v1.0.1 \nLast update time: ' + str(time.strftime("%H:%M:%S", time.localtime())))
-            self.window.after(1000, self.pollDirectory)
+            self.window.after(50, self.drain_results)
+
+    def _on_draw(self, j):
+        """
+        Full redraw of spectrum plot j happened (first show, resize): recaches the static background and
+        puts the animated line and title back on top.
+
+        :param j: Plot index
+        :return: None
+        """
+        canvas = self.list_of_spectra_plot_lineplot[j]
+        figure = self.list_of_spectra_plots[j]
+        self.list_of_spectra_backgrounds[j] = canvas.copy_from_bbox(figure.bbox)
+        self._draw_animated(j)
+
+    def _draw_animated(self, j):
+        ax = self.list_of_spectra_plot_ax[j]
+        ax.draw_artist(self.list_of_spectra_plot_ax_line[j])
+        ax.draw_artist(self.list_of_spectra_titles[j])
+
+    def update_spectrum(self, j, path, dat):
+        """
+        Shows a spectrum in plot j by swapping the line data and blitting it over the cached background
+
+        :param j: Plot index
+        :param path: Spectrum file, None to clear the plot
+        :param dat: (rows, 2) spectrum data, parsed by the worker. None if it couldn't be read.
+        :return: None
+        """
+        if self.shown_spectra[j] == path:
+            return
+        if path is None or dat is None:
+            self.list_of_spectra_decimated[j].set_data([], [])
+            self.list_of_spectra_titles[j].set_text('' if path is None else os.path.basename(path))
+        else:
+            self.list_of_spectra_decimated[j].set_data(dat[:, 0], dat[:, 1])
+            self.list_of_spectra_titles[j].set_text(os.path.basename(path))
+        self.shown_spectra[j] = path
+        self.shown_spectra_data[j] = dat
+        canvas = self.list_of_spectra_plot_lineplot[j]
+        background = self.list_of_spectra_backgrounds[j]
+        if background is None:
+            # never drawn yet, the draw event caches the background and draws the line
+            canvas.draw_idle()
+            return
+        canvas.restore_region(background)
+        self._draw_animated(j)
+        canvas.blit(self.list_of_spectra_plots[j].bbox)
 
     def _on_mousewheel(self, event):
         """
@@ -155,75 +255,177 @@ class imageViewer:
         :return:
         """
         # scroll on command
-        self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
+        self._on_scroll('scroll', int(-1 * (event.delta / 120)), 'units')
+
+    def _row_height(self):
+        # rows are all laid out the same, the first one stands in for the rest
+        return max(1, self.list_of_rtnframe[0].winfo_height())
 
-    def update_image(self, img_dir_list, spectra_dir_list):
+    def _on_scroll(self, *args):
         """
-        Updates screen with specified number of images in init, side by side with
-        their corresponding spectra.
+        Scrollbar callback
 
-        :param: img_dir_list: List of files present in the image directory. Does not include full file path
-        :param: spectra_dir_list: List of files present in the spectra directory. Does not include full file path
+        :param args: ('moveto', fraction) or ('scroll', number, 'units' or 'pages')
         :return: None
         """
+        if args[0] == 'moveto':
+            y = float(args[1]) * self.history_total * self._row_height()
+        else:
+            step = self._row_height() / 4 if args[2] == 'units' else self.canvas.winfo_height()
+            y = self.history_y + int(args[1]) * step
+        self.scroll_history(y)
 
-        # get 5 most recent files and reverse list so that the most recent is index 0
-        self.img_dir_list = img_dir_list[-self.num_of_images:]
-        self.img_dir_list.reverse()
-        self.spectra_dir_list = spectra_dir_list[-self.num_of_images:]
-        self.spectra_dir_list.reverse()
+    def scroll_history(self, y):
+        """
+        Scrolls through the run as if every shot had its own row. The pool of num_of_images rows is moved on to the
+        shots under y and the canvas is scrolled by whatever is left over, so scrolling costs the same no matter
+        how long the run is. Rows that land on new shots are filled by the worker.
 
-        if self.most_recent_spectra == self.spectra_dir_list[0] and self.most_recent_image == self.img_dir_list[0]:
-            return
+        :param y: Pixels below the top of the newest shot
+        :return: None
+        """
+        row = self._row_height()
+        view = self.canvas.winfo_height()
+        total = self.history_total * row
+        y = min(max(0., y), max(0., total - view))
+        first = min(int(y // row), max(0, self.history_total - self.num_of_images))
+        self.history_y = y
+        self.canvas.yview_moveto((y - first * row) / max(1, self.scrollFrame.winfo_height()))
+        if total > 0:
+            self.scrollbar.set(y / total, min(1., (y + view) / total))
         else:
-            self.most_recent_image = self.img_dir_list[0]
+            self.scrollbar.set(0., 1.)
+        if first != self.history_first:
+            self.history_first = first
+            self.worker.request(first)
+
+    def update_image(self, update):
+        """
+        Updates screen with specified number of images in init, side by side with
+        their corresponding spectra.
+
+        :param: update: ViewerUpdate from the worker, one image/spectrum pair per row, newest shots first
+        :return: None
+        """
+        self.img_dir_list = [image[0] if image else None for image, spectrum in update.shots]
+        self.spectra_dir_list = [spectrum[0] if spectrum else None for image, spectrum in update.shots]
+        if self.img_dir_list:
+            self.current_display = self.most_recent_image = self.img_dir_list[0]
             self.most_recent_spectra = self.spectra_dir_list[0]
+        self.unmatched_text = '\nUnmatched: %d images, %d spectra' % update.unmatched if any(update.unmatched) else ''
+        if update.shots:
+            self.history_text = '\nShots %d-%d of %d, newest first' % (update.first + 1, update.first + len(update.shots),
+                                                                     max(update.total, len(update.shots)))
+
+        for j, (image, spectrum) in enumerate(update.shots):
+            if image is None:
+                # the spectrum of this shot came in without an image
+                self.list_of_sample_header[j].config(text='No image')
+                self.list_of_sample_images_label[j].config(image='')
+                self.list_of_sample_images_label[j].image = None
+            elif image[3] is None:
+                # the worker couldn't read it, its header says so
+                self.list_of_sample_header[j].config(text=image[1])
+                self.list_of_sample_images_label[j].config(image='')
+                self.list_of_sample_images_label[j].image = None
+            else:
+                name, header, key, thumbnail = image
+                # set title of frame to file name
+                self.list_of_sample_header[j].config(text=header)
+                # the worker already decoded and scaled it, only the PhotoImage has to be made here
+                self.sample_tkimage = self.thumbnails.get(key, lambda: ImageTk.PhotoImage(thumbnail))
+                self.list_of_sample_images_label[j].config(image=self.sample_tkimage)
+                self.list_of_sample_images_label[j].image = self.sample_tkimage
 
-        for j, i in enumerate(self.img_dir_list):
-            # change dir to image dir
-            os.chdir(self.image_target_dir)
-            # set title of frame to file name
-            self.list_of_sample_header[j].config(text=i.split('\\')[-1])
-            # open and scale image, then insert into label
-            self.sample_image = Image.open(i)
-            factor = 0.35
-            self.sample_image = self.sample_image.resize(
-                (int(self.sample_image.size[0] * factor), int(self.sample_image.size[1] * factor)),
-                Image.ANTIALIAS)
-            self.sample_tkimage = ImageTk.PhotoImage(self.sample_image)
-
-            self.list_of_sample_images_label[j].config(image=self.sample_tkimage)
-            self.list_of_sample_images_label[j].image = self.sample_tkimage
-
-            # Change dir to spectra dir
-            os.chdir(self.spectra_target_dir)
-            # yeet old plot
-            self.list_of_spectra_plot_ax[j].clear()
-            # set title of the plot to file name
-            self.list_of_spectra_headers[j].config(text=self.spectra_dir_list[j].split('\\')[-1])
-            # pull data from target file
-            dat = np.loadtxt(self.spectra_dir_list[j], dtype=float, delimiter=';')
-            # plot
-            self.list_of_spectra_plot_ax[j].plot(dat[:, 0], dat[:, 1], linewidth=0.35)
-            # Set plot-oriented stuff
-            self.list_of_spectra_plot_ax[j].set_xlim([200, 1000])
-            self.list_of_spectra_plot_ax[j].set_ylim([0, 1])
-            self.list_of_spectra_plot_ax[j].set_xlabel('Wavelength(nm)')
-            self.list_of_spectra_plot_ax[j].set_ylabel('Intensity')
-            self.list_of_spectra_plot_ax[j].set_title(self.spectra_dir_list[j].split('\\')[-1])
-            self.list_of_spectra_plots[j].canvas.draw()
-            # actually display the graph
-            self.list_of_spectra_plot_lineplot[j].get_tk_widget().grid(row=1, column=0, columnspan=2)
-            # garbage collection?
-            del dat
+            path, dat, lines = spectrum if spectrum is not None else (None, None, None)
+            # set title of the plot to file name, and the elements whose lines were found in it
+            header = os.path.basename(path) if path else 'No spectrum'
+            if path and dat is None:
+                header += '\nCould not load spectrum'
+            if lines is not None:
+                header += '\n' + lines.summary()
+            self.list_of_spectra_headers[j].config(text=header)
+            self.shown_spectra_lines[j] = lines
+            # new data into the existing line, only redrawn if it's a different spectrum
+            self.update_spectrum(j, path, dat)
+        # rows past the end of a short run
+        for j in range(len(update.shots), self.num_of_images):
+            self.list_of_sample_header[j].config(text='')
+            self.list_of_sample_images_label[j].config(image='')
+            self.list_of_sample_images_label[j].image = None
+            self.list_of_spectra_headers[j].config(text='')
+            self.update_spectrum(j, None, None)
         self.iter += 1
 
+    def zoom(self, j):
+        """
+        Opens shot j at full resolution in its own window. The only place a whole frame gets decoded.
+
+        :param j: Image index, 0 is the newest
+        :return: None
+        """
+        # live frames are only kept as thumbnails
+        if j >= len(self.img_dir_list) or not self.img_dir_list[j] or not os.path.isfile(self.img_dir_list[j]):
+            return
+        path = self.img_dir_list[j]
+        try:
+            image = ImageTk.PhotoImage(load_preview(path))
+        except Exception as e:
+            print(e)
+            return
+        window = tk.Toplevel(master=self.window)
+        window.title(os.path.basename(path))
+        label = tk.Label(master=window, image=image)
+        label.image = image
+        label.grid(row=0, column=0)
+
+    def zoom_spectrum(self, j):
+        """
+        Opens spectrum j in its own window with the matplotlib toolbar and its identified lines marked. The line
+        is re-decimated for every zoom and pan, so zooming in brings out the full resolution around a line.
+
+        :param j: Plot index, 0 is the newest
+        :return: None
+        """
+        path, dat = self.shown_spectra[j], self.shown_spectra_data[j]
+        if path is None or dat is None or not len(dat):
+            return
+        window = tk.Toplevel(master=self.window)
+        window.title(os.path.basename(path))
+        figure = plt.Figure(figsize=(10, 5), dpi=100)
+        ax = figure.add_subplot(111)
+        ax.set_xlabel('Wavelength(nm)')
+        ax.set_ylabel('Intensity')
+        canvas = FigureCanvasTkAgg(figure, window)
+        line = DecimatedLine(ax.plot([], [], linewidth=0.5)[0])
+        # limits first, the decimation only keeps what is in view
+        ax.set_xlim(np.nanmin(dat[:, 0]), np.nanmax(dat[:, 0]))
+        ax.set_ylim(min(0., np.nanmin(dat[:, 1])), np.nanmax(dat[:, 1]) * 1.05)
+        line.set_data(dat[:, 0], dat[:, 1])
+        # mark the identified lines
+        lines = self.shown_spectra_lines[j]
+        for peak, height, name, wavelength in (lines.matches if lines is not None else []):
+            ax.axvline(wavelength, color='tab:red', linewidth=0.5, alpha=0.5)
+            ax.text(wavelength, 0.98, '%s %.2f' % (name, wavelength), transform=ax.get_xaxis_transform(),
+                    rotation=90, va='top', ha='right', fontsize=7)
+        toolbar = NavigationToolbar2Tk(canvas, window, pack_toolbar=False)
+        toolbar.update()
+        canvas.get_tk_widget().grid(row=0, column=0)
+        toolbar.grid(row=1, column=0, sticky='ew')
+        # keep the window's plot objects alive with it
+        window.zoom_line = line
+        canvas.draw()
+
     def onClosing(self):
         """
         Allows closing of windows to be cleaner versus tkinter's build in methods
 
         :return: None
         """
+        if self.closed:
+            return
+        self.closed = True
+        self.worker.stop()
         self.window.destroy()
 
 
@@ -0,0 +1,186 @@
+import os
+import threading
+import numpy as np
+from FrameStats import STAT_NAMES
+
+# per frame columns and their on-disk dtypes
+COLUMNS = (
+    ('shot', np.int64),              # shot number, -1 for frames that never got one (incomplete)
+    ('frame_id', np.int64),          # camera frame ID
+    ('device_timestamp', np.int64),  # camera timestamp (ns)
+    ('host_time', np.float64),       # host time the frame was received (s since epoch)
+    ('status', np.int32),            # Spinnaker image status, or one of the DROPPED_ codes below
+    ('width', np.int32),
+    ('height', np.int32),
+    ('missing_before', np.int32),    # frame IDs skipped between the previous frame and this one
+) + tuple((name, np.float64) for name in STAT_NAMES)  # FrameStats image statistics, NaN if not computed
+
+# status codes for frames the camera delivered but the host threw away
+DROPPED_RING = -1
+DROPPED_WRITER = -2
+
+
+class FrameLog:
+    """
+    Compact columnar log of every frame delivered by the camera during a run.
+
+    Each column is appended to its own raw binary file in the log directory,
+    so a column can be loaded on its own with np.fromfile and a crash loses
+    at most one unflushed chunk. Save times arrive later from the writer
+    threads and go to a separate (row, time) file that load_frame_log merges
+    back in.
+
+    Missing frames show up as follows:
+        missing_before > 0   the camera frame ID jumped: lost on the trigger/camera side or in transfer
+        status < 0           the host dropped the frame (ring overrun or writer queue full)
+        save_time is NaN     the frame was queued but never made it to disk
+    """
+    def __init__(self, directory, chunk=256, attrs=None):
+        """
+        :param directory: Directory for this run's log. Created if needed.
+        :param chunk: Rows buffered in memory between writes
+        :param attrs: Optional dict of run level metadata, written to attrs.txt
+        """
+        self.directory = directory
+        self.chunk = max(1, int(chunk))
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'columns.txt'), 'w') as f:
+            for name, dtype in COLUMNS:
+                f.write('%s;%s\n' % (name, np.dtype(dtype).str))
+        if attrs:
+            with open(os.path.join(directory, 'attrs.txt'), 'w') as f:
+                for k, v in attrs.items():
+                    f.write('%s: %s\n' % (k, v))
+        self.buffers = {name: np.zeros(self.chunk, dtype=dtype) for name, dtype in COLUMNS}
+        self.files = {name: open(os.path.join(directory, name + '.bin'), 'ab') for name, dtype in COLUMNS}
+        self.saved = np.zeros((self.chunk, 2), dtype=np.float64)
+        self.saved_file = open(os.path.join(directory, 'save_time.bin'), 'ab')
+        self.n = 0
+        self.n_saved = 0
+        self.rows = 0
+        self.last_frame_id = None
+        self.gaps = 0
+        self.missing = 0
+
+    def record(self, shot, frame_id, device_timestamp, host_time, status, width, height, stats=None):
+        """
+        Logs a frame as it comes off the camera and checks the frame ID sequence.
+
+        :param stats: Optional tuple of image statistics in FrameStats.STAT_NAMES order
+        :return: (row of the frame in the log, number of frame IDs missing right before it)
+        """
+        with self.lock:
+            # flushed lazily so the newest row stays in memory for set_status
+            if self.n == self.chunk:
+                self._flush_rows()
+            missing = 0
+            if self.last_frame_id is not None and frame_id > self.last_frame_id + 1:
+                missing = frame_id - self.last_frame_id - 1
+                self.gaps += 1
+                self.missing += missing
+            if self.last_frame_id is None or frame_id > self.last_frame_id:
+                self.last_frame_id = frame_id
+            i = self.n
+            for name, value in (('shot', shot), ('frame_id', frame_id), ('device_timestamp', device_timestamp),
+                                ('host_time', host_time), ('status', status), ('width', width),
+                                ('height', height), ('missing_before', missing)):
+                self.buffers[name][i] = value
+            for name, value in zip(STAT_NAMES, stats or (np.nan,) * len(STAT_NAMES)):
+                self.buffers[name][i] = value
+            row = self.rows
+            self.n += 1
+            self.rows += 1
+            return row, missing
+
+    def set_status(self, row, status):
+        """
+        Changes the status of a frame still buffered in memory, e.g. when the writer queue rejects it.
+        The most recently recorded row is always still buffered.
+
+        :param row: Row returned by record()
+        :param status: New status
+        :return: True if the row was still buffered and got updated
+        """
+        with self.lock:
+            i = row - (self.rows - self.n)
+            if 0 <= i < self.n:
+                self.buffers['status'][i] = status
+                return True
+            return False
+
+    def mark_saved(self, row, save_time):
+        """
+        Records when a frame finished writing. Called from the writer threads.
+
+        :param row: Row returned by record()
+        :param save_time: Time the save finished (s since epoch)
+        :return: None
+        """
+        with self.lock:
+            self.saved[self.n_saved] = (row, save_time)
+            self.n_saved += 1
+            if self.n_saved == self.chunk:
+                self._flush_saved()
+
+    def _flush_rows(self):
+        for name, dtype in COLUMNS:
+            self.buffers[name][:self.n].tofile(self.files[name])
+            self.files[name].flush()
+        self.n = 0
+
+    def _flush_saved(self):
+        self.saved[:self.n_saved].tofile(self.saved_file)
+        self.saved_file.flush()
+        self.n_saved = 0
+
+    def flush(self):
+        """
+        Writes all buffered rows and save times to disk
+
+        :return: None
+        """
+        with self.lock:
+            self._flush_rows()
+            self._flush_saved()
+
+    def summary(self):
+        """
+        :return: dict with the number of frames logged, frame ID gaps and total frames missing
+        """
+        with self.lock:
+            return {'frames': self.rows, 'gaps': self.gaps, 'missing': self.missing}
+
+    def close(self):
+        with self.lock:
+            self._flush_rows()
+            self._flush_saved()
+            for f in self.files.values():
+                f.close()
+            self.saved_file.close()
+
+
+def load_frame_log(directory):
+    """
+    Loads a frame log written by FrameLog.
+
+    :param directory: Log directory
+    :return: dict of column name to numpy array, including a save_time column (NaN for frames never saved)
+    """
+    columns = {}
+    with open(os.path.join(directory, 'columns.txt')) as f:
+        for line in f:
+            name, _, dtype = line.strip().partition(';')
+            if name:
+                columns[name] = np.fromfile(os.path.join(directory, name + '.bin'), dtype=np.dtype(dtype))
+    rows = min(len(c) for c in columns.values()) if columns else 0
+    columns = {k: v[:rows] for k, v in columns.items()}
+    save_time = np.full(rows, np.nan)
+    path = os.path.join(directory, 'save_time.bin')
+    if os.path.exists(path):
+        saved = np.fromfile(path, dtype=np.float64).reshape(-1, 2)
+        idx = saved[:, 0].astype(np.int64)
+        ok = idx < rows
+        save_time[idx[ok]] = saved[ok, 1]
+    columns['save_time'] = save_time
+    return columns
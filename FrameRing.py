@@ -0,0 +1,104 @@
+import threading
+import numpy as np
+
+
+class FrameRing:
+    """
+    Preallocated ring of N frames. The grab loop copies each raw camera buffer
+    into the next free slot exactly once and hands views of that slot to later
+    stages (writers, display, analysis), so nothing is allocated per frame.
+
+    A slot is claimed by the grab loop and stays busy until every consumer
+    has released it. If the next slot is still busy when a frame arrives the
+    ring has overrun and the frame is counted and dropped.
+    """
+    def __init__(self, num_slots=16, height=1024, width=1280, dtype=np.uint8):
+        """
+        :param num_slots: Number of frames held in the ring
+        :param height: Frame height in pixels
+        :param width: Frame width in pixels
+        :param dtype: Pixel dtype of the stored frames
+        """
+        self.num_slots = max(2, int(num_slots))
+        self.frames = np.zeros((self.num_slots, height, width), dtype=dtype)
+        self.refs = [0] * self.num_slots
+        self.head = 0
+        self.lock = threading.Lock()
+        self.stored = 0
+        self.overruns = 0
+
+    @property
+    def shape(self):
+        """
+        :return: (height, width) of a single frame
+        """
+        return self.frames.shape[1:]
+
+    def claim(self, refs=1):
+        """
+        Claims the next slot in the ring for writing.
+
+        :param refs: Number of consumers that will release this slot
+        :return: Slot index, or None if the ring has overrun
+        """
+        with self.lock:
+            idx = self.head
+            if self.refs[idx]:
+                self.overruns += 1
+                return None
+            self.refs[idx] = max(1, refs)
+            self.head = (idx + 1) % self.num_slots
+            return idx
+
+    def store(self, idx, data):
+        """
+        Copies a frame into a claimed slot. Frames smaller than the ring (e.g. after an ROI change)
+        fill the top left corner of the slot.
+
+        :param idx: Slot index from claim()
+        :param data: 2D array of pixel data, e.g. from image.GetNDArray()
+        :return: View of the stored frame
+        """
+        h, w = data.shape[:2]
+        view = self.frames[idx, :h, :w]
+        np.copyto(view, data, casting='unsafe')
+        self.stored += 1
+        return view
+
+    def view(self, idx, height=None, width=None):
+        """
+        :param idx: Slot index
+        :param height: Height of the stored frame, defaults to the full slot
+        :param width: Width of the stored frame, defaults to the full slot
+        :return: View into the slot. Only valid until the slot is released.
+        """
+        return self.frames[idx, :height, :width]
+
+    def addref(self, idx, n=1):
+        """
+        Registers additional consumers of a claimed slot.
+
+        :param idx: Slot index
+        :param n: Number of extra releases to wait for
+        :return: None
+        """
+        with self.lock:
+            self.refs[idx] += n
+
+    def release(self, idx):
+        """
+        Releases one consumer's hold on a slot. The slot is reused once all consumers released it.
+
+        :param idx: Slot index
+        :return: None
+        """
+        with self.lock:
+            if self.refs[idx]:
+                self.refs[idx] -= 1
+
+    def busy(self):
+        """
+        :return: Number of slots still held by consumers
+        """
+        with self.lock:
+            return sum(1 for r in self.refs if r)
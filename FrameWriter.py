@@ -0,0 +1,180 @@
+import threading
+import queue
+import time
+from collections import deque
+import numpy as np
+from PIL import Image
+
+# number of most recent grab-to-disk latencies kept for percentiles
+LATENCY_SAMPLES = 10000
+
+
+class FrameWriterPool:
+    """
+    Bounded queue of frames waiting to be written to disk, drained by a pool
+    of encoder threads so that the grab loop in CamCapture never waits on
+    compression or disk access.
+
+    Backpressure counters:
+        submitted:  frames handed to the pool
+        written:    frames successfully saved
+        failed:     frames whose save raised an exception
+        dropped:    frames rejected because the queue was full
+        blocked:    submits that had to wait for space (block=True only)
+        high_water: deepest the queue has been
+
+    If frames are submitted with the time they were grabbed, the time from
+    grab to finished write is kept for the most recent frames as well.
+    """
+    def __init__(self, num_workers=2, queue_size=64, block=False):
+        """
+        :param num_workers: Number of encoder threads
+        :param queue_size: Max number of frames waiting to be written
+        :param block: If True, submit waits for space when the queue is full instead of dropping the frame
+        """
+        self.num_workers = max(1, int(num_workers))
+        self.queue_size = max(1, int(queue_size))
+        self.block = block
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.high_water = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.workers = []
+        for i in range(self.num_workers):
+            t = threading.Thread(target=self._work, name='FrameWriter-%d' % i, daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def submit(self, save, filename, done=None, grabbed=None):
+        """
+        Queues a frame to be written.
+
+        :param save: Callable taking the filename, e.g. a converted PySpin image's Save method
+        :param filename: Full path of the file to write
+        :param done: Optional callable run by the writer once the save has finished (or failed). Not run for
+                     dropped frames.
+        :param grabbed: Optional time.perf_counter() of when the frame was grabbed, for latency stats
+        :return: True if the frame was queued, False if it was dropped
+        """
+        item = (save, filename, done, grabbed)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            if not self.block:
+                with self.lock:
+                    self.dropped += 1
+                return False
+            with self.lock:
+                self.blocked += 1
+            self.queue.put(item)
+        with self.lock:
+            self.submitted += 1
+            depth = self.queue.qsize()
+            if depth > self.high_water:
+                self.high_water = depth
+        return True
+
+    def _work(self):
+        """
+        Worker thread body. Pulls frames off the queue and saves them until a None sentinel arrives.
+
+        :return: None
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                save, filename, done, grabbed = item
+                try:
+                    save(filename)
+                    with self.lock:
+                        self.written += 1
+                        if grabbed is not None:
+                            self.latencies.append(time.perf_counter() - grabbed)
+                except Exception as e:
+                    print('Error writing %s: %s' % (filename, e))
+                    with self.lock:
+                        self.failed += 1
+                finally:
+                    if done is not None:
+                        done()
+            finally:
+                self.queue.task_done()
+
+    def pending(self):
+        """
+        :return: Number of frames queued but not yet written
+        """
+        return self.queue.qsize()
+
+    def stats(self):
+        """
+        Snapshot of the backpressure counters
+
+        :return: dict of counter name to value
+        """
+        with self.lock:
+            return {
+                'submitted': self.submitted,
+                'written': self.written,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'blocked': self.blocked,
+                'high_water': self.high_water,
+                'pending': self.queue.qsize(),
+            }
+
+    def latency_percentiles(self, percentiles=(50, 99)):
+        """
+        :param percentiles: Percentiles to compute
+        :return: dict of percentile to grab-to-disk latency in seconds, None if nothing has been timed
+        """
+        with self.lock:
+            samples = np.array(self.latencies)
+        if not len(samples):
+            return {p: None for p in percentiles}
+        return dict(zip(percentiles, np.percentile(samples, percentiles).tolist()))
+
+    def falling_behind(self):
+        """
+        :return: True if the queue is more than 3/4 full
+        """
+        return self.queue.qsize() > 0.75 * self.queue_size
+
+    def close(self, timeout=None):
+        """
+        Writes out everything still queued, then stops the workers.
+
+        :param timeout: Max seconds to wait for each worker to finish, None to wait forever
+        :return: None
+        """
+        for _ in self.workers:
+            self.queue.put(None)
+        st = time.time()
+        for t in self.workers:
+            if timeout is None:
+                t.join()
+            else:
+                t.join(max(0., timeout - (time.time() - st)))
+        self.workers = []
+
+
+def save_frame(frame, filename):
+    """
+    Saves a 2D numpy frame. 'raw' files are the bare pixel buffer, anything else is encoded by PIL
+    according to the file extension.
+
+    :param frame: 2D array of pixel data
+    :param filename: Full path of the file to write
+    :return: None
+    """
+    if filename.endswith('.raw'):
+        frame.tofile(filename)
+    else:
+        Image.fromarray(frame).save(filename)
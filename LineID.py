@@ -0,0 +1,233 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from SpectraLoader import load_spectrum
+
+# table of known lines, element;ion stage;wavelength per line
+LINE_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Config', 'atomic_lines.txt')
+# peaks have to stand this many noise standard deviations above the baseline
+PEAK_SIGMA = 5.
+# peaks closer than this (nm) count as one, so noise on the flanks of a line doesn't turn into extra peaks
+PEAK_SEPARATION = 0.5
+# max distance in nm between a peak and a table line for them to match. The spectrometer resolves ~2 nm, so
+# don't go much tighter than its wavelength calibration.
+MATCH_TOLERANCE = 0.5
+# elements shown in one line summaries
+ELEMENTS_SHOWN = 4
+# baseline and noise are estimated from about this many points, evenly spread over the spectrum
+NOISE_SAMPLES = 8192
+
+
+def find_peaks(x, y, sigma=PEAK_SIGMA, separation=PEAK_SEPARATION):
+    """
+    Finds emission peaks: local maxima more than sigma noise standard deviations above the baseline. The
+    baseline is the median of the spectrum and the noise comes from the median absolute point to point
+    difference, so neither is thrown off by the lines themselves.
+
+    The spectrum is cut into blocks about separation wide and a peak is the highest point of a block that is
+    higher than the blocks either side, which keeps it O(n) however finely the spectrum is sampled. Peak
+    positions are refined to below a sample with a parabola through the top three points.
+
+    :param x: 1D array of wavelengths, ascending and roughly evenly spaced
+    :param y: 1D array of intensities
+    :param sigma: Detection threshold in noise standard deviations
+    :param separation: Peaks closer than this (same unit as x) count as one
+    :return: (wavelengths, heights above baseline) of the peaks, ascending in wavelength
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(y) < 3:
+        return np.empty(0), np.empty(0)
+    every = max(1, len(y) // NOISE_SAMPLES)
+    baseline = np.median(y[::every])
+    # MAD of the differences, scaled to the standard deviation of a single point's noise
+    noise = 1.4826 * np.median(np.abs(np.diff(y))[::every]) / np.sqrt(2.)
+    threshold = baseline + sigma * max(noise, np.finfo(np.float64).tiny)
+    step = (x[-1] - x[0]) / (len(x) - 1)
+    block = max(1, int(round(separation / step))) if step > 0 else 1
+    n = len(y) // block * block
+    # index of the highest point of every block
+    highest = y[:n].reshape(-1, block).argmax(axis=1) + np.arange(0, n, block)
+    tops = y[highest]
+    mid = tops[1:-1]
+    i = highest[np.flatnonzero((mid > tops[:-2]) & (mid >= tops[2:]) & (mid > threshold)) + 1]
+    i = i[(i > 0) & (i < len(y) - 1)]
+    left, top, right = y[i - 1], y[i], y[i + 1]
+    curvature = left - 2 * top + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.where(curvature != 0, 0.5 * (left - right) / curvature, 0.)
+    return x[i] + shift * (x[i + 1] - x[i - 1]) / 2, top - baseline
+
+
+class LineTable:
+    """
+    Known emission lines sorted by wavelength, so a whole spectrum's peaks
+    are matched with two searchsorted calls.
+    """
+    def __init__(self, elements, ions, wavelengths):
+        """
+        :param elements: Element symbol of each line
+        :param ions: Ion stage of each line ('I' neutral, 'II' singly ionised, ...)
+        :param wavelengths: Wavelength of each line in nm
+        """
+        order = np.argsort(wavelengths, kind='stable')
+        self.wavelengths = np.asarray(wavelengths, dtype=np.float64)[order]
+        self.elements = np.asarray(elements)[order]
+        self.ions = np.asarray(ions)[order]
+        self.names = np.array(['%s %s' % i for i in zip(self.elements, self.ions)])
+        # element of each line as an index into element_names, for bincount
+        self.element_names, self.element_codes = np.unique(self.elements, return_inverse=True)
+        self.element_lines = np.bincount(self.element_codes, minlength=len(self.element_names))
+
+    @classmethod
+    def load(cls, path=LINE_TABLE):
+        """
+        :param path: Table file, element;ion stage;wavelength per line, # starts a comment line
+        :return: LineTable
+        """
+        elements, ions, wavelengths = [], [], []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                element, ion, wavelength = [i.strip() for i in line.split(';')[:3]]
+                elements.append(element)
+                ions.append(ion)
+                wavelengths.append(float(wavelength))
+        return cls(elements, ions, wavelengths)
+
+    def __len__(self):
+        return len(self.wavelengths)
+
+    def match(self, peaks, tolerance=MATCH_TOLERANCE):
+        """
+        Finds every table line within tolerance of each peak
+
+        :param peaks: 1D array of peak wavelengths
+        :param tolerance: Max distance in nm
+        :return: (peak indices, line indices) of all matching pairs
+        """
+        peaks = np.asarray(peaks, dtype=np.float64)
+        lo = np.searchsorted(self.wavelengths, peaks - tolerance, 'left')
+        hi = np.searchsorted(self.wavelengths, peaks + tolerance, 'right')
+        counts = hi - lo
+        peak_idx = np.repeat(np.arange(len(peaks)), counts)
+        # lo, lo + 1, ..., hi - 1 for every peak, all in one go
+        line_idx = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - lo, counts)
+        return peak_idx, line_idx
+
+
+class LineReport:
+    """
+    Lines identified in one spectrum.
+
+    peaks:      (wavelengths, heights) of every peak found
+    matches:    (peak wavelength, height, line name, line wavelength) per matched line, ascending in wavelength
+    elements:   (element, lines matched, lines in the table, summed height) per candidate element, strongest first
+    """
+    def __init__(self, peaks, matches, elements, seconds=0.):
+        self.peaks = peaks
+        self.matches = matches
+        self.elements = elements
+        self.seconds = seconds
+
+    def summary(self, n=ELEMENTS_SHOWN):
+        """
+        :param n: Number of elements to list
+        :return: One line summary of the strongest candidate elements, e.g. 'Na 2/4, H 1/3'
+        """
+        if not self.elements:
+            return 'No lines identified' if len(self.peaks[0]) else 'No peaks'
+        return ', '.join('%s %d/%d' % e[:3] for e in self.elements[:n])
+
+
+def identify(x, y, table, tolerance=MATCH_TOLERANCE, sigma=PEAK_SIGMA, separation=PEAK_SEPARATION):
+    """
+    Finds the peaks of a spectrum and matches them to the line table
+
+    :param x: 1D array of wavelengths, ascending
+    :param y: 1D array of intensities
+    :param table: LineTable
+    :param tolerance: Max distance in nm between a peak and a line
+    :param sigma: Peak detection threshold, see find_peaks
+    :param separation: Peaks closer than this count as one, see find_peaks
+    :return: LineReport
+    """
+    st = time.perf_counter()
+    wavelengths, heights = find_peaks(x, y, sigma, separation)
+    peak_idx, line_idx = table.match(wavelengths, tolerance)
+    # each table line counts once, with the tallest peak that matched it
+    line_height = np.zeros(len(table))
+    np.maximum.at(line_height, line_idx, heights[peak_idx])
+    # the peak that gave each matched line its height
+    best = np.zeros(len(table), dtype=np.int64)
+    tallest = heights[peak_idx] == line_height[line_idx]
+    best[line_idx[tallest]] = peak_idx[tallest]
+    matched = np.flatnonzero(line_height > 0)
+    matches = [(wavelengths[best[i]], line_height[i], table.names[i], table.wavelengths[i]) for i in matched]
+    codes = table.element_codes[matched]
+    counts = np.bincount(codes, minlength=len(table.element_names))
+    sums = np.bincount(codes, weights=line_height[matched], minlength=len(table.element_names))
+    elements = [(table.element_names[e], int(counts[e]), int(table.element_lines[e]), float(sums[e]))
+                for e in np.argsort(-sums, kind='stable') if counts[e]]
+    return LineReport((wavelengths, heights), matches, elements, time.perf_counter() - st)
+
+
+def spectrum_files(paths):
+    """
+    :param paths: Spectrum files and/or directories of them
+    :return: List of spectrum files, directories expanded to their (non hidden) files in name order
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, i) for i in sorted(os.listdir(path))
+                         if not i.startswith('.') and os.path.isfile(os.path.join(path, i)))
+        else:
+            files.append(path)
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Identify emission lines in spectra')
+    parser.add_argument('paths', nargs='+', help='spectrum files or directories of them, e.g. an archived run')
+    parser.add_argument('--table', default=LINE_TABLE, help='line table, element;ion stage;wavelength per line')
+    parser.add_argument('--tolerance', type=float, default=MATCH_TOLERANCE, help='max peak to line distance in nm')
+    parser.add_argument('--sigma', type=float, default=PEAK_SIGMA, help='peak threshold in noise standard deviations')
+    parser.add_argument('-o', '--output', help='write every matched line to this file, ; separated')
+    args = parser.parse_args(argv)
+
+    table = LineTable.load(args.table)
+    files = spectrum_files(args.paths)
+    out = open(args.output, 'w') if args.output else None
+    if out is not None:
+        out.write('file;peak (nm);height;line;line (nm)\n')
+    spent = 0.
+    for path in files:
+        try:
+            dat = load_spectrum(path)
+        except (OSError, ValueError) as e:
+            print('Could not read %s: %s' % (path, e), file=sys.stderr)
+            continue
+        if dat.ndim != 2 or dat.shape[1] < 2 or not len(dat):
+            print('%s is not a spectrum, skipped' % path, file=sys.stderr)
+            continue
+        report = identify(dat[:, 0], dat[:, 1], table, args.tolerance, args.sigma)
+        spent += report.seconds
+        print('%s: %s (%d peaks, %.1f ms)' % (os.path.basename(path), report.summary(len(table.element_names)),
+                                              len(report.peaks[0]), report.seconds * 1e3))
+        if out is not None:
+            for peak, height, name, line in report.matches:
+                out.write('%s;%.3f;%.6g;%s;%.2f\n' % (os.path.basename(path), peak, height, name, line))
+    if out is not None:
+        out.close()
+    if files:
+        print('%d spectra, %.2f ms per spectrum' % (len(files), spent / len(files) * 1e3))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
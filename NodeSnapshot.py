@@ -0,0 +1,148 @@
+import os
+import time
+
+
+def load_node_config(path):
+    """
+    Reads a camera configuration file of 'Node Name: value' lines, like Config/flir_cam_changables.txt.
+    Spaces in node names are dropped, so 'AcquisitionFrame Rate' means the AcquisitionFrameRate node.
+
+    :param path: Config file
+    :return: dict of node name to value string, in file order
+    """
+    config = {}
+    with open(path) as f:
+        for line in f:
+            name, sep, value = line.partition(':')
+            if sep and name.strip():
+                config[name.replace(' ', '')] = value.strip()
+    return config
+
+
+def write_node_config(path, values, header=None):
+    """
+    Writes node values in the same 'Name: value' format load_node_config reads
+
+    :param path: File to write
+    :param values: dict of node name to value string
+    :param header: Optional comment line written first
+    :return: None
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        if header:
+            f.write('# %s\n' % header)
+        for name, value in values.items():
+            f.write('%s: %s\n' % (name, value))
+    os.replace(tmp, path)
+
+
+def _same(current, wanted):
+    """
+    Compares node values as strings, numbers within rounding of what the camera stores
+
+    :return: True if writing wanted would not change anything
+    """
+    if current == wanted:
+        return True
+    try:
+        a, b = float(current), float(wanted)
+    except ValueError:
+        return current.lower() == wanted.lower()
+    return abs(a - b) <= 1e-4 * max(abs(a), abs(b), 1e-9)
+
+
+class NodeSnapshot:
+    """
+    Cached copy of a set of camera node values.
+
+    Every node is read once up front, and configuration is applied against
+    that copy: only nodes whose value differs get written, and written
+    values update the copy instead of being read back. The camera usually
+    already holds the wanted configuration from the last run, so startup
+    mostly costs one pass of reads instead of a write (and a USB round trip)
+    per node.
+    """
+    def __init__(self, PySpin, nodemap, names):
+        """
+        :param PySpin: The PySpin module in use (real or simulated)
+        :param nodemap: GenICam nodemap of an initialized camera
+        :param names: Node names to keep track of
+        """
+        self.PySpin = PySpin
+        self.nodemap = nodemap
+        self.names = list(dict.fromkeys(names))
+        self.values = {}
+        self.refresh()
+
+    def _node(self, name):
+        node = self.nodemap.GetNode(name)
+        if not self.PySpin.IsAvailable(node):
+            return None
+        return self.PySpin.CValuePtr(node)
+
+    def refresh(self):
+        """
+        Reads all tracked nodes from the camera. Unavailable or unreadable nodes are left out.
+
+        :return: None
+        """
+        self.values = {}
+        for name in self.names:
+            node = self._node(name)
+            if node is not None and self.PySpin.IsReadable(node):
+                self.values[name] = node.ToString()
+
+    def get(self, name, default=None):
+        """
+        :param name: Node name
+        :param default: Returned if the node isn't tracked or isn't readable
+        :return: Cached value string
+        """
+        return self.values.get(name, default)
+
+    def apply(self, desired):
+        """
+        Writes the nodes whose cached value differs from the desired one, in the order given. Nodes that
+        aren't writable yet (e.g. ExposureTime while ExposureAuto is still on) get a second try after the rest.
+
+        :param desired: dict of node name to value string
+        :return: (names of nodes written, dict of node name to reason for nodes that could not be set)
+        """
+        written = []
+        skipped = {}
+        pending = [(name, value) for name, value in desired.items()
+                   if name not in self.values or not _same(self.values[name], value)]
+        for attempt in range(2):
+            retry = []
+            for name, value in pending:
+                node = self._node(name)
+                if node is None:
+                    skipped[name] = 'not available'
+                    continue
+                if not self.PySpin.IsWritable(node):
+                    retry.append((name, value))
+                    skipped[name] = 'not writable'
+                    continue
+                try:
+                    node.FromString(value)
+                except self.PySpin.SpinnakerException as ex:
+                    skipped[name] = str(ex)
+                    continue
+                skipped.pop(name, None)
+                self.values[name] = node.ToString() if self.PySpin.IsReadable(node) else value
+                written.append(name)
+            if not retry or len(retry) == len(pending):
+                break
+            pending = retry
+        return written, skipped
+
+    def save(self, path, header=None):
+        """
+        Writes the cached values to disk
+
+        :param path: File to write
+        :param header: Optional comment line, defaults to the time of writing
+        :return: None
+        """
+        write_node_config(path, self.values, header or time.strftime('%Y-%m-%d %H:%M:%S'))
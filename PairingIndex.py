@@ -0,0 +1,249 @@
+import os
+import re
+import bisect
+
+# How images and spectra are matched up:
+#   'time'  by modification time, each file paired with the nearest unpaired file of the other kind within
+#           PAIR_TOLERANCE seconds. Works whatever the spectrometer software calls its files.
+#   'shot'  by the shot number in the file names, read with IMAGE_SHOT_PATTERN and SPECTRUM_SHOT_PATTERN. Only
+#           for a spectra directory whose files are named with the camera's shot numbers.
+PAIR_BY = 'time'
+PAIR_TOLERANCE = 0.5
+# Regular expressions whose first group is the shot number in a file name. The camera saves Shot-<n>.ext or
+# Shot-<serial>-<n>.ext. Spectrometer software has its own numbering, which doesn't follow the camera's shot
+# counter across runs, so there is no spectrum pattern unless one is set for a directory that matches,
+# e.g. r'^spectrum_(\d+)\.txt$'. Files that don't match have no shot number.
+IMAGE_SHOT_PATTERN = r'^Shot-(?:\d+-)?(\d+)\.'
+SPECTRUM_SHOT_PATTERN = None
+KINDS = ('image', 'spectrum')
+
+
+def shot_number(path, pattern):
+    """
+    :param path: Image or spectrum file
+    :param pattern: Compiled regular expression whose first group is the shot number, or None
+    :return: Shot number from the file name, e.g. 12 for Shot-12.png or Shot-20123456-12.png with
+             IMAGE_SHOT_PATTERN. None if the name doesn't match.
+    """
+    m = pattern.search(os.path.basename(path)) if pattern is not None else None
+    return int(m.group(1)) if m else None
+
+
+class PairedShot:
+    """
+    One shot: its image and spectrum files, either of which may still be missing
+    """
+    __slots__ = ('shot', 'image', 'spectrum', 'image_time', 'spectrum_time', 'order')
+
+    def __init__(self, shot, order):
+        self.shot = shot
+        self.order = order
+        self.image = self.spectrum = None
+        self.image_time = self.spectrum_time = None
+
+    def paired(self):
+        return self.image is not None and self.spectrum is not None
+
+    def __repr__(self):
+        return 'PairedShot(%r, %r, %r)' % (self.shot, self.image, self.spectrum)
+
+
+class PairingIndex:
+    """
+    Matches camera images to spectra shot by shot, kept up to date
+    incrementally from DirectoryIndex.changes() so a missing or late file only
+    affects its own shot instead of shifting every pair after it.
+
+    Shots are ordered by shot number when pairing by shot, and by the time of
+    their first file when pairing by time. Files without a shot number can't
+    be paired by shot and are listed in unnumbered. Either way a shot whose
+    image has a shot number can be looked up with get().
+    """
+    def __init__(self, by=PAIR_BY, tolerance=PAIR_TOLERANCE, image_pattern=IMAGE_SHOT_PATTERN,
+                 spectrum_pattern=SPECTRUM_SHOT_PATTERN):
+        """
+        :param by: 'shot' or 'time', see PAIR_BY
+        :param tolerance: Max mtime difference in seconds for a pair, when pairing by time
+        :param image_pattern: Shot number pattern of the image files, see IMAGE_SHOT_PATTERN
+        :param spectrum_pattern: Shot number pattern of the spectrum files. Required when pairing by shot.
+        """
+        if by not in ('shot', 'time'):
+            raise ValueError('Unknown pairing %s' % by)
+        if by == 'shot' and not (image_pattern and spectrum_pattern):
+            raise ValueError('Pairing by shot needs an image and a spectrum file name pattern')
+        self.by = by
+        self.tolerance = tolerance
+        self.patterns = {'image': re.compile(image_pattern) if image_pattern else None,
+                         'spectrum': re.compile(spectrum_pattern) if spectrum_pattern else None}
+        self.rows = {}  # row id -> PairedShot. The shot number when pairing by shot
+        self.order = []  # sorted (order, row id)
+        self.where = {}  # path -> row id
+        self.shots = {}  # shot number -> row id, when pairing by time
+        self.unnumbered = set()
+        # pairing by time: sorted (mtime, row id) of the rows holding only an image, and only a spectrum
+        self.lone = {kind: [] for kind in KINDS}
+        self.next_id = 0
+
+    def _new_row(self, shot, order):
+        if self.by == 'shot':
+            row_id = shot
+        else:
+            row_id = self.next_id
+            self.next_id += 1
+        row = self.rows[row_id] = PairedShot(shot, order)
+        bisect.insort(self.order, (order, row_id))
+        return row_id, row
+
+    def _drop_row(self, row_id):
+        row = self.rows.pop(row_id)
+        i = bisect.bisect_left(self.order, (row.order, row_id))
+        if i < len(self.order) and self.order[i] == (row.order, row_id):
+            del self.order[i]
+
+    def _lone_remove(self, kind, mtime, row_id):
+        lone = self.lone[kind]
+        i = bisect.bisect_left(lone, (mtime, row_id))
+        if i < len(lone) and lone[i] == (mtime, row_id):
+            del lone[i]
+
+    def _nearest_lone(self, kind, mtime):
+        """
+        :return: Index in self.lone[kind] of the entry closest in time to mtime, None if none is within tolerance
+        """
+        lone = self.lone[kind]
+        i = bisect.bisect_left(lone, (mtime,))
+        best = None
+        for j in (i - 1, i):
+            if 0 <= j < len(lone) and abs(lone[j][0] - mtime) <= self.tolerance:
+                if best is None or abs(lone[j][0] - mtime) < abs(lone[best][0] - mtime):
+                    best = j
+        return best
+
+    def add(self, kind, path, mtime):
+        """
+        Adds a new or modified file
+
+        :param kind: 'image' or 'spectrum'
+        :param path: File
+        :param mtime: Its modification time
+        :return: PairedShot it ended up in, None if it couldn't be placed
+        """
+        if path in self.where or path in self.unnumbered:
+            self.remove(path)
+        shot = shot_number(path, self.patterns[kind])
+        if self.by == 'shot':
+            if shot is None:
+                self.unnumbered.add(path)
+                return None
+            row = self.rows.get(shot)
+            if row is None:
+                row_id, row = self._new_row(shot, shot)
+            else:
+                row_id = shot
+                # a newer file for the same shot replaces the old one
+                if getattr(row, kind) is not None:
+                    del self.where[getattr(row, kind)]
+        else:
+            other = KINDS[1 - KINDS.index(kind)]
+            i = self._nearest_lone(other, mtime)
+            if i is None:
+                row_id, row = self._new_row(shot, mtime)
+                bisect.insort(self.lone[kind], (mtime, row_id))
+            else:
+                row_id = self.lone[other].pop(i)[1]
+                row = self.rows[row_id]
+                if kind == 'image' and shot is not None:
+                    row.shot = shot
+            if row.shot is not None:
+                self.shots[row.shot] = row_id
+        setattr(row, kind, path)
+        setattr(row, kind + '_time', mtime)
+        self.where[path] = row_id
+        return row
+
+    def remove(self, path):
+        """
+        Forgets a file that was deleted (or is about to be re-added)
+
+        :param path: File
+        :return: None
+        """
+        self.unnumbered.discard(path)
+        row_id = self.where.pop(path, None)
+        if row_id is None:
+            return
+        row = self.rows[row_id]
+        kind = 'image' if row.image == path else 'spectrum'
+        other = KINDS[1 - KINDS.index(kind)]
+        mtime = getattr(row, kind + '_time')
+        setattr(row, kind, None)
+        setattr(row, kind + '_time', None)
+        if self.by == 'time':
+            if getattr(row, other) is None:
+                self._lone_remove(kind, mtime, row_id)
+            else:
+                # left with only the other file, which is free to pair again
+                bisect.insort(self.lone[other], (getattr(row, other + '_time'), row_id))
+            if kind == 'image' or row.image is None:
+                # the shot number went with the image, or the row is going
+                if self.shots.get(row.shot) == row_id:
+                    del self.shots[row.shot]
+                row.shot = shot_number(row.spectrum, self.patterns['spectrum']) if row.spectrum else None
+                if row.shot is not None:
+                    self.shots.setdefault(row.shot, row_id)
+        if row.image is None and row.spectrum is None:
+            self._drop_row(row_id)
+
+    def update(self, image_changes, spectrum_changes):
+        """
+        Applies changes from the image and spectra DirectoryIndex
+
+        :param image_changes: DirectoryIndex.changes() of the image directory
+        :param spectrum_changes: DirectoryIndex.changes() of the spectra directory
+        :return: None
+        """
+        changes = [(mtime, kind, path) for kind, c in zip(KINDS, (image_changes, spectrum_changes))
+                   for path, mtime in c.items()]
+        for mtime, kind, path in changes:
+            if mtime is None:
+                self.remove(path)
+        # both kinds together and oldest first, so pairing by time matches files in the order they were written
+        for mtime, kind, path in sorted(c for c in changes if c[0] is not None):
+            self.add(kind, path, mtime)
+
+    def get(self, shot):
+        """
+        :param shot: Shot number
+        :return: PairedShot or None if no file with that shot number has come in yet
+        """
+        if self.by == 'shot':
+            return self.rows.get(shot)
+        row_id = self.shots.get(shot)
+        return self.rows[row_id] if row_id is not None else None
+
+    def newest(self, n=None):
+        """
+        :param n: Number of shots, None for all
+        :return: List of the n newest PairedShots, oldest first
+        """
+        items = self.order if n is None else self.order[-n:]
+        return [self.rows[row_id] for order, row_id in items]
+
+    def window(self, start, n):
+        """
+        :param start: Number of newer shots to skip, 0 for the newest
+        :param n: Number of shots
+        :return: List of up to n PairedShots, oldest first
+        """
+        end = max(0, len(self.order) - start)
+        return [self.rows[row_id] for order, row_id in self.order[max(0, end - n):end]]
+
+    def unmatched(self):
+        """
+        :return: (shots with only an image, shots with only a spectrum), each a list of PairedShots oldest first
+        """
+        rows = self.newest()
+        return [r for r in rows if r.spectrum is None], [r for r in rows if r.image is None]
+
+    def __len__(self):
+        return len(self.rows)
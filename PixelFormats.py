@@ -0,0 +1,134 @@
+import numpy as np
+
+# name: (significant bits, packing). Unpacked formats >8 bit come as little endian 16 bit words holding the
+# native counts, packed formats squeeze two 12 bit pixels into 3 bytes.
+PIXEL_FORMATS = {
+    'Mono8': (8, None),
+    'Mono10': (10, None),
+    'Mono12': (12, None),
+    'Mono16': (16, None),
+    'Mono12p': (12, 'p'),
+    'Mono12Packed': (12, 'packed'),
+}
+
+# file formats that can hold 16 bit greyscale without losing anything
+LOSSLESS_16BIT_EXTENSIONS = ('png', 'tif', 'tiff', 'raw', 'h5')
+
+
+def bit_depth(name):
+    """
+    :param name: Pixel format name, e.g. 'Mono12p'
+    :return: Number of significant bits per pixel
+    """
+    return PIXEL_FORMATS[name][0]
+
+
+def frame_dtype(name):
+    """
+    :param name: Pixel format name
+    :return: numpy dtype frames of this format are stored as
+    """
+    return np.uint8 if bit_depth(name) <= 8 else np.uint16
+
+
+def is_packed(name):
+    """
+    :param name: Pixel format name
+    :return: True if pixels are packed across byte boundaries
+    """
+    return PIXEL_FORMATS[name][1] is not None
+
+
+def preview_shift(name):
+    """
+    :param name: Pixel format name
+    :return: Right shift that brings pixels of this format down to 8 bits for display
+    """
+    return max(0, bit_depth(name) - 8)
+
+
+def unpack_mono12p(raw, height, width):
+    """
+    Unpacks GenICam Mono12p (LSB first: p0 = b0 | (b1 & 0xF) << 8, p1 = b1 >> 4 | b2 << 4).
+
+    :param raw: 1D uint8 buffer of the packed image
+    :param height: Image height
+    :param width: Image width
+    :return: (height, width) uint16 array of native 12 bit counts
+    """
+    b = np.frombuffer(raw, dtype=np.uint8, count=height * width * 3 // 2).reshape(-1, 3).astype(np.uint16)
+    out = np.empty((b.shape[0], 2), dtype=np.uint16)
+    out[:, 0] = b[:, 0] | ((b[:, 1] & 0x0F) << 8)
+    out[:, 1] = (b[:, 1] >> 4) | (b[:, 2] << 4)
+    return out.reshape(height, width)
+
+
+def unpack_mono12packed(raw, height, width):
+    """
+    Unpacks legacy Mono12Packed (p0 = b0 << 4 | b1 & 0xF, p1 = b2 << 4 | b1 >> 4).
+
+    :param raw: 1D uint8 buffer of the packed image
+    :param height: Image height
+    :param width: Image width
+    :return: (height, width) uint16 array of native 12 bit counts
+    """
+    b = np.frombuffer(raw, dtype=np.uint8, count=height * width * 3 // 2).reshape(-1, 3).astype(np.uint16)
+    out = np.empty((b.shape[0], 2), dtype=np.uint16)
+    out[:, 0] = (b[:, 0] << 4) | (b[:, 1] & 0x0F)
+    out[:, 1] = (b[:, 2] << 4) | (b[:, 1] >> 4)
+    return out.reshape(height, width)
+
+
+def pack_mono12(frame, name):
+    """
+    Packs 12 bit counts, the inverse of the unpack functions. Used by the simulated camera.
+
+    :param frame: 2D uint16 array with an even number of pixels
+    :param name: 'Mono12p' or 'Mono12Packed'
+    :return: 1D uint8 buffer
+    """
+    p = frame.reshape(-1, 2).astype(np.uint16)
+    out = np.empty((p.shape[0], 3), dtype=np.uint8)
+    if name == 'Mono12p':
+        out[:, 0] = p[:, 0] & 0xFF
+        out[:, 1] = (p[:, 0] >> 8) | ((p[:, 1] & 0x0F) << 4)
+        out[:, 2] = p[:, 1] >> 4
+    else:
+        out[:, 0] = p[:, 0] >> 4
+        out[:, 1] = (p[:, 0] & 0x0F) | ((p[:, 1] & 0x0F) << 4)
+        out[:, 2] = p[:, 1] >> 4
+    return out.reshape(-1)
+
+
+def native_frame(image, name):
+    """
+    Gets an image's pixels in its native bit depth without going through Spinnaker's Convert.
+
+    :param image: Spinnaker image
+    :param name: Pixel format the camera is set to
+    :return: 2D array of native counts. For unpacked formats this is a view of the image buffer, so copy it
+             before releasing the image.
+    """
+    packing = PIXEL_FORMATS[name][1]
+    if packing == 'p':
+        return unpack_mono12p(image.GetData(), image.GetHeight(), image.GetWidth())
+    if packing == 'packed':
+        return unpack_mono12packed(image.GetData(), image.GetHeight(), image.GetWidth())
+    return image.GetNDArray()
+
+
+def to_preview(frame, bits=None):
+    """
+    Makes an 8 bit display copy of a frame.
+
+    :param frame: 2D array
+    :param bits: Significant bits of the frame. If None, 8 bit frames are returned as is and anything deeper is
+                 scaled by its own maximum.
+    :return: 2D uint8 array
+    """
+    if frame.dtype == np.uint8:
+        return frame
+    if bits is None:
+        peak = int(frame.max())
+        bits = max(8, peak.bit_length())
+    return (frame >> (bits - 8)).astype(np.uint8)
@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+import numpy as np
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# rows added to the datasets each time they fill up, so we don't resize on every shot
+_GROW_BY = 256
+
+
+def _require_h5py():
+    if h5py is None:
+        raise ImportError('h5py is required for run file storage. Install it with "pip install h5py" '
+                          'or save frames as individual image files instead.')
+
+
+class RunFileWriter:
+    """
+    Appends every frame of a camera run to a single chunked HDF5 file instead
+    of writing one image file per shot.
+
+    Layout:
+        /frames     (n, height, width) frame stack, one chunk per frame, optionally compressed
+        /shot       shot number of each row
+        /timestamp  host time (s since epoch) each frame was appended
+        /width, /height   size of the frame stored in each row
+
+    Rows are in the order they were appended; RunFileReader builds a shot
+    number -> row index so any shot can be fetched directly. The file is
+    written in SWMR mode so the viewer can read it while the camera runs.
+    """
+    def __init__(self, filename, height, width, dtype=np.uint8, compression=None, attrs=None):
+        """
+        :param filename: Full path of the run file to create. An existing file is never overwritten, it raises
+                         instead.
+        :param height: Frame height in pixels
+        :param width: Frame width in pixels
+        :param dtype: Pixel dtype
+        :param compression: h5py compression filter, e.g. 'lzf' or 'gzip'. None stores frames uncompressed.
+        :param attrs: Optional dict of run level metadata stored as file attributes
+        """
+        _require_h5py()
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.count = 0
+        self.capacity = _GROW_BY
+        self.file = h5py.File(filename, 'w-', libver='latest')
+        self.file.attrs['created'] = time.time()
+        for k, v in (attrs or {}).items():
+            self.file.attrs[k] = v
+        self.frames = self.file.create_dataset('frames', shape=(self.capacity, height, width),
+                                               maxshape=(None, height, width), dtype=dtype,
+                                               chunks=(1, height, width), compression=compression)
+        self.columns = {}
+        for name, col_dtype in (('shot', np.int64), ('timestamp', np.float64),
+                                ('width', np.int32), ('height', np.int32)):
+            # unused rows read back as -1 so readers can tell where the run currently ends
+            self.columns[name] = self.file.create_dataset(name, shape=(self.capacity,), maxshape=(None,),
+                                                          dtype=col_dtype, chunks=(_GROW_BY,), fillvalue=-1)
+        self.file.swmr_mode = True
+
+    def append(self, frame, shot, timestamp=None):
+        """
+        Appends a frame to the run. Safe to call from several writer threads.
+
+        :param frame: 2D array of pixel data, no larger than the run's frame size
+        :param shot: Shot number of the frame
+        :param timestamp: Host time of the frame, defaults to now
+        :return: Row the frame was stored in
+        """
+        h, w = frame.shape[:2]
+        with self.lock:
+            row = self.count
+            if row >= self.capacity:
+                self.capacity += _GROW_BY
+                self.frames.resize(self.capacity, axis=0)
+                for col in self.columns.values():
+                    col.resize((self.capacity,))
+            self.frames[row, :h, :w] = frame
+            self.columns['shot'][row] = shot
+            self.columns['timestamp'][row] = time.time() if timestamp is None else timestamp
+            self.columns['width'][row] = w
+            self.columns['height'][row] = h
+            self.count = row + 1
+            # shot column last, so SWMR readers never see a shot whose frame isn't there yet
+            self.frames.flush()
+            for name in ('timestamp', 'width', 'height', 'shot'):
+                self.columns[name].flush()
+            return row
+
+    def close(self):
+        """
+        Trims unused rows and closes the file.
+
+        :return: None
+        """
+        with self.lock:
+            if self.file is None:
+                return
+            self.frames.resize(self.count, axis=0)
+            for col in self.columns.values():
+                col.resize((self.count,))
+            self.file.close()
+            self.file = None
+
+
+class RunFileReader:
+    """
+    Random access to the frames of a run file by shot number
+    """
+    def __init__(self, filename, swmr=True):
+        """
+        :param filename: Full path of the run file
+        :param swmr: Open in SWMR mode so a run that is still being written can be read
+        """
+        _require_h5py()
+        self.filename = filename
+        self.file = h5py.File(filename, 'r', libver='latest', swmr=swmr)
+        self.index = {}
+        self.count = 0
+        self.refresh()
+
+    def refresh(self):
+        """
+        Picks up shots appended since the file was opened or last refreshed.
+
+        :return: Number of new shots
+        """
+        for name in ('frames', 'shot', 'timestamp', 'width', 'height'):
+            self.file[name].refresh()
+        shots = self.file['shot'][self.count:]
+        new = 0
+        for shot in shots:
+            if shot < 0:
+                break
+            self.index[int(shot)] = self.count
+            self.count += 1
+            new += 1
+        return new
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, shot):
+        return shot in self.index
+
+    def __getitem__(self, shot):
+        """
+        :param shot: Shot number
+        :return: Frame of the given shot
+        """
+        row = self.index[shot]
+        h = self.file['height'][row]
+        w = self.file['width'][row]
+        return self.file['frames'][row, :h, :w]
+
+    def shots(self):
+        """
+        :return: List of shot numbers in the run, in the order they were captured
+        """
+        return sorted(self.index, key=self.index.get)
+
+    def metadata(self, shot):
+        """
+        :param shot: Shot number
+        :return: dict of the per-shot metadata columns
+        """
+        row = self.index[shot]
+        return {name: self.file[name][row].item() for name in ('shot', 'timestamp', 'width', 'height')}
+
+    def close(self):
+        self.file.close()
+
+
+def run_filename(twd, device_serial_number=''):
+    """
+    Builds a unique run file name for a new camera run. Runs started within the same second get a -2, -3, ...
+    suffix rather than the same name.
+
+    :param twd: Directory the run file goes in
+    :param device_serial_number: Camera serial number, may be empty
+    :return: Full path of the run file
+    """
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime())
+    base = 'Run-%s-%s' % (device_serial_number, stamp) if device_serial_number else 'Run-%s' % stamp
+    filename = os.path.join(twd, base + '.h5')
+    n = 2
+    while os.path.exists(filename):
+        filename = os.path.join(twd, '%s-%d.h5' % (base, n))
+        n += 1
+    return filename
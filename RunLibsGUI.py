@@ -2,7 +2,6 @@
 import os.path
 import os
 import sys
-import keyboard
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import tkinter as tk
 from tkinter import filedialog
@@ -32,7 +31,13 @@ class runcam:
         self.image_directory = os.getcwd()
 
         # Do you want to change the type of images you save? You've come to the right place!
+        # 'h5' appends every shot of a run to a single run file instead of one image per shot
         self.file_extension = 'png' # add a dropdown to select?
+        # shared memory block the camera publishes live frames to for the viewer
+        self.shared_frames = 'libsgui-frames-%d' % os.getpid()
+        self.process = None
+        self.stop_event = None
+        self.imageview = None
 
         # Don't touch anything below here!
         self.config_file = 'Config/dirConfig.npz'
@@ -77,9 +82,7 @@ class runcam:
         self.stahpCaptureButton = tk.Button(master=self.window, text='Stop Camera', command=self.stopCamera)
         self.stahpCaptureButton.grid(row=6, column=0, columnspan=2, sticky='nsew')
 
-        self.launchImageViewbtn = tk.Button(master=self.window, text='Launch Viewer',
-                                            command=lambda: imageViewer(self.image_directory, self.spectra_directory,
-                                                                        self.file_extension, self.window))
+        self.launchImageViewbtn = tk.Button(master=self.window, text='Launch Viewer', command=self.showImageViewer)
         self.launch_dg645 = tk.Button(master=self.window, text='Launch Stanford Box',
                                       command=lambda: self.launchStanfordBox(self.window))
         self.launch_dg645.grid(row=8, column=0, columnspan=2, sticky='nsew')
@@ -153,7 +156,10 @@ class runcam:
 
         :return:
         """
-        self.imageview = imageViewer(self.image_directory, self.spectra_directory, self.file_extension, self.window)
+        if self.imageview is not None:
+            self.imageview.onClosing()
+        self.imageview = imageViewer(self.image_directory, self.spectra_directory, self.file_extension, self.window,
+                                     shared_frames=self.shared_frames)
 
     def load_dir_on_open(self):
         """
@@ -198,24 +204,28 @@ class runcam:
 
         :return:
         """
-        self.process = mp.Process(target=camMain, args=(self.image_directory, self.file_extension))   # args for image_directory, start number from above inputs.
+        self.stop_event = mp.Event()
+        self.process = mp.Process(target=camMain, args=(self.image_directory, self.file_extension),
+                                  kwargs={'shared_frames': self.shared_frames,
+                                          'stop_event': self.stop_event})   # args for image_directory, start number from above inputs.
         self.process.start()
 
     def stopCamera(self):
         """
-        Camera is hardcoded to yeet itself if esc is pressed. Should probably change it so that it's some weird
-        key combo so that it doesn't get pressed in use
+        Tells the camera process to stop through its stop event and waits for it to finish saving
 
         :return:
         """
-        try:
-            keyboard.press('esc')
-            self.process.join()
-            keyboard.release('esc')
+        if self.process is None:
+            print('Camera is not running')
+            return
+        self.stop_event.set()
+        self.process.join()
+        self.process = None
+        # the viewer goes with the camera
+        if self.imageview is not None:
             self.imageview.onClosing()
-
-        except:
-            print('Failed to stop camera. Run!')
+            self.imageview = None
 
     def _onClosing(self):
         """
@@ -224,13 +234,11 @@ class runcam:
         :return: None
         """
         try:
-            # I don't like this implementation, but it works. I foresee issues in the future. Avoid this in the future.
-            keyboard.press('esc')
-            self.process.join()
-            keyboard.release('esc')
-
-        except:
-            pass
+            if self.process is not None:
+                self.stop_event.set()
+                self.process.join()
+            if self.imageview is not None:
+                self.imageview.onClosing()
         finally:
             self.save_dir_on_exit()
             self.window.destroy()
@@ -0,0 +1,199 @@
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from FrameStats import STAT_NAMES
+
+# header layout (int64): magic, number of slots, slot height, slot width, latest published sequence number, state
+_MAGIC = 0x4C494254
+_HEADER_LEN = 8
+# state: set to _CLOSED by the camera process when it stops publishing, before it unlinks the block
+_OPEN = 1
+_CLOSED = 2
+# per slot layout (int64): sequence number (-1 while being written), shot number, frame height, frame width
+_SLOT_META_LEN = 4
+# per slot image statistics (float64), FrameStats.STAT_NAMES order
+_SLOT_STATS_LEN = len(STAT_NAMES)
+
+
+class SharedFrameRing:
+    """
+    Ring of the most recent frames in shared memory so the camera process can
+    hand frames straight to the viewer without writing and decoding files.
+
+    The camera process creates the ring and publishes every frame into it,
+    the viewer attaches by name and copies out the latest frames. Each slot
+    carries the sequence number it was written with; readers check it before
+    and after copying to discard slots overwritten mid-read.
+    """
+    def __init__(self, name, num_slots=8, height=1024, width=1280, create=False):
+        """
+        :param name: Name of the shared memory block
+        :param num_slots: Number of frames in the ring (create only)
+        :param height: Max frame height (create only)
+        :param width: Max frame width (create only)
+        :param create: True in the camera process to create the block, False to attach to an existing one
+        """
+        self.name = name
+        self.owner = create
+        if create:
+            size = 8 * (_HEADER_LEN + num_slots * (_SLOT_META_LEN + _SLOT_STATS_LEN)) + num_slots * height * width
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                # left over from a camera process that didn't clean up
+                old = shared_memory.SharedMemory(name=name)
+                old.close()
+                old.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.header = np.ndarray((_HEADER_LEN,), dtype=np.int64, buffer=self.shm.buf)
+            self.header[:] = 0
+            self.header[1:4] = (num_slots, height, width)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            try:
+                # the camera process owns the block, stop this process's resource tracker removing it on exit
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            except Exception:
+                pass
+            self.header = np.ndarray((_HEADER_LEN,), dtype=np.int64, buffer=self.shm.buf)
+            if self.header[0] != _MAGIC:
+                self.header = None
+                self.shm.close()
+                raise ValueError('Shared memory block %s is not a frame ring' % name)
+            if self.header[5] != _OPEN:
+                # a finished camera run whose block is still mapped somewhere
+                self.header = None
+                self.shm.close()
+                raise ValueError('Shared memory block %s has been closed by the camera' % name)
+        self.num_slots, self.height, self.width = (int(i) for i in self.header[1:4])
+        offset = 8 * _HEADER_LEN
+        self.meta = np.ndarray((self.num_slots, _SLOT_META_LEN), dtype=np.int64, buffer=self.shm.buf,
+                               offset=offset)
+        offset += 8 * self.num_slots * _SLOT_META_LEN
+        self.stats = np.ndarray((self.num_slots, _SLOT_STATS_LEN), dtype=np.float64, buffer=self.shm.buf,
+                                offset=offset)
+        offset += 8 * self.num_slots * _SLOT_STATS_LEN
+        self.frames = np.ndarray((self.num_slots, self.height, self.width), dtype=np.uint8, buffer=self.shm.buf,
+                                 offset=offset)
+        if create:
+            self.meta[:] = 0
+            self.stats[:] = np.nan
+            self.header[5] = _OPEN
+            # publish the magic last so readers never see a half initialised block
+            self.header[0] = _MAGIC
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attaches to a ring created by another process.
+
+        :param name: Name of the shared memory block
+        :return: SharedFrameRing, or None if it doesn't exist (yet)
+        """
+        try:
+            return cls(name)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def publish(self, frame, shot, shift=0, stats=None):
+        """
+        Copies a frame into the next slot. Camera process only.
+
+        :param frame: 2D array, no larger than the ring's height and width
+        :param shot: Shot number of the frame
+        :param shift: Right shift bringing deeper frames down to the ring's 8 bits, e.g. 4 for 12 bit frames
+        :param stats: Optional tuple of image statistics in FrameStats.STAT_NAMES order
+        :return: Sequence number the frame was published under
+        """
+        seq = int(self.header[4]) + 1
+        slot = (seq - 1) % self.num_slots
+        h, w = frame.shape[:2]
+        self.meta[slot, 0] = -1
+        if shift:
+            # shifts straight into the slot, no temporary 8 bit copy
+            np.right_shift(frame, shift, out=self.frames[slot, :h, :w], casting='unsafe')
+        else:
+            np.copyto(self.frames[slot, :h, :w], frame, casting='unsafe')
+        self.meta[slot, 1:] = (shot, h, w)
+        self.stats[slot] = np.nan if stats is None else stats
+        self.meta[slot, 0] = seq
+        self.header[4] = seq
+        return seq
+
+    def is_closed(self):
+        """
+        Readers should detach once this is True. The camera that created the block has stopped, and a restarted
+        camera publishes into a new block under the same name.
+
+        :return: True if the creating process has closed the ring
+        """
+        return self.header is None or int(self.header[5]) != _OPEN
+
+    def latest_seq(self):
+        """
+        :return: Sequence number of the most recently published frame, 0 if none yet
+        """
+        return int(self.header[4])
+
+    def latest(self, n=1, since=0):
+        """
+        Copies out the most recent frames, newest first.
+
+        :param n: Max number of frames to return
+        :param since: Only return frames published after this sequence number
+        :return: List of (sequence number, shot number, frame) tuples
+        """
+        out = []
+        last = self.latest_seq()
+        for seq in range(last, max(since, last - min(n, self.num_slots - 1)), -1):
+            slot = (seq - 1) % self.num_slots
+            if self.meta[slot, 0] != seq:
+                continue
+            shot, h, w = (int(i) for i in self.meta[slot, 1:])
+            frame = self.frames[slot, :h, :w].copy()
+            # the writer may have lapped us while copying
+            if self.meta[slot, 0] != seq:
+                continue
+            out.append((seq, shot, frame))
+        return out
+
+    def latest_stats(self, n=1, since=0):
+        """
+        Reads the image statistics of the most recent frames without copying the frames, newest first.
+
+        :param n: Max number of frames to return
+        :param since: Only return frames published after this sequence number
+        :return: List of (sequence number, shot number, stats tuple in FrameStats.STAT_NAMES order)
+        """
+        out = []
+        last = self.latest_seq()
+        for seq in range(last, max(since, last - min(n, self.num_slots - 1)), -1):
+            slot = (seq - 1) % self.num_slots
+            if self.meta[slot, 0] != seq:
+                continue
+            shot = int(self.meta[slot, 1])
+            stats = tuple(float(i) for i in self.stats[slot])
+            if self.meta[slot, 0] != seq:
+                continue
+            out.append((seq, shot, stats))
+        return out
+
+    def close(self):
+        """
+        Unmaps the block, and removes it if this process created it.
+
+        :return: None
+        """
+        if self.owner and self.header is not None:
+            # tell attached readers to let go before the name goes away
+            self.header[5] = _CLOSED
+        # drop the numpy views first, otherwise the buffer can't be released
+        self.header = None
+        self.meta = None
+        self.stats = None
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,147 @@
+import os
+import re
+import threading
+from RunFile import RunFileReader
+
+# sidecar directory inside the image directory. It's a directory so the viewer's file listing skips it
+MANIFEST_DIR = '.libsgui'
+
+
+class ShotManifest:
+    """
+    Sidecar index of the shots saved in an image directory, so the camera can
+    start numbering without listing and parsing the whole directory.
+
+    Two files live in <image directory>/.libsgui/:
+        next_shot<tag>.txt      the next free shot number, rewritten atomically after every save
+        shots<tag>.manifest     append-only 'shot;filename' line per saved shot
+
+    Opening only reads next_shot, so camera start takes the same time no
+    matter how many shots the directory holds. If the counter is missing (new
+    directory, or someone deleted it) both files are rebuilt from a single
+    scan of the directory.
+    """
+    def __init__(self, twd, file_extension, tag=''):
+        """
+        :param twd: Image directory
+        :param file_extension: Extension shots are saved with, e.g. 'png' or 'h5'
+        :param tag: Optional suffix to keep separate counters in one directory, e.g. a camera serial number
+        """
+        self.twd = twd
+        self.file_extension = file_extension
+        self.tag = tag
+        self.lock = threading.Lock()
+        self.sidecar_dir = os.path.join(twd, MANIFEST_DIR)
+        suffix = '-%s' % tag if tag else ''
+        self.counter_file = os.path.join(self.sidecar_dir, 'next_shot%s.txt' % suffix)
+        self.manifest_file = os.path.join(self.sidecar_dir, 'shots%s.manifest' % suffix)
+        os.makedirs(self.sidecar_dir, exist_ok=True)
+
+        self.next_shot = self._read_counter()
+        if self.next_shot is None:
+            print('No shot manifest found - rebuilding from directory contents')
+            self.rebuild()
+        self.manifest = open(self.manifest_file, 'a')
+
+    def _read_counter(self):
+        """
+        :return: Next shot number stored in the counter file, or None if it is missing or unreadable
+        """
+        try:
+            with open(self.counter_file) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _write_counter(self):
+        """
+        Atomically replaces the counter file with the current next shot number
+
+        :return: None
+        """
+        tmp = self.counter_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('%d\n' % self.next_shot)
+        os.replace(tmp, self.counter_file)
+
+    def scan(self):
+        """
+        Scans the image directory for saved shots. Only used to rebuild the manifest.
+
+        :return: Sorted list of (shot number, filename) tuples
+        """
+        shots = []
+        # a tagged manifest only counts its own camera's files
+        run_prefix = 'Run-%s-' % self.tag if self.tag else 'Run-'
+        serial = re.escape(self.tag) + '-' if self.tag else '(?:.+-)?'
+        if self.file_extension == 'h5':
+            for i in os.listdir(self.twd):
+                if i.startswith(run_prefix) and i.endswith('.h5'):
+                    try:
+                        reader = RunFileReader(os.path.join(self.twd, i), swmr=False)
+                        shots.extend((shot, '%s#%d' % (i, shot)) for shot in reader.shots())
+                        reader.close()
+                    except Exception as e:
+                        print('Could not read run file %s: %s' % (i, e))
+        else:
+            # Shot-<n>.ext or Shot-<serial>-<n>.ext, anything else is ignored
+            pattern = re.compile(r'^Shot-%s(\d+)\.%s$' % (serial, re.escape(self.file_extension)))
+            for i in os.listdir(self.twd):
+                m = pattern.match(i)
+                if m:
+                    shots.append((int(m.group(1)), i))
+        return sorted(shots)
+
+    def rebuild(self):
+        """
+        Rewrites the manifest and counter from a scan of the image directory
+
+        :return: None
+        """
+        with self.lock:
+            shots = self.scan()
+            tmp = self.manifest_file + '.tmp'
+            with open(tmp, 'w') as f:
+                for shot, name in shots:
+                    f.write('%d;%s\n' % (shot, name))
+            os.replace(tmp, self.manifest_file)
+            self.next_shot = shots[-1][0] + 1 if shots else 1
+            self._write_counter()
+
+    def record(self, shot, filename):
+        """
+        Records a saved shot. Safe to call from several writer threads.
+
+        :param shot: Shot number
+        :param filename: File the shot was saved to
+        :return: None
+        """
+        with self.lock:
+            self.manifest.write('%d;%s\n' % (shot, os.path.basename(filename)))
+            self.manifest.flush()
+            if shot >= self.next_shot:
+                self.next_shot = shot + 1
+                try:
+                    self._write_counter()
+                except OSError as e:
+                    print('Could not update shot counter: %s' % e)
+
+    def shots(self):
+        """
+        Reads the full shot list back from the manifest
+
+        :return: List of (shot number, filename) tuples in the order they were saved
+        """
+        with self.lock:
+            self.manifest.flush()
+        out = []
+        with open(self.manifest_file) as f:
+            for line in f:
+                shot, _, name = line.rstrip('\n').partition(';')
+                if name:
+                    out.append((int(shot), name))
+        return out
+
+    def close(self):
+        with self.lock:
+            self.manifest.close()
@@ -0,0 +1,611 @@
+"""
+Simulated stand in for the parts of PySpin used by CamCapture, so the
+acquisition path can run and be benchmarked without the FLIR camera or
+the Spinnaker SDK.
+
+Select it by setting the environment variable LIBSGUI_CAMERA=sim before
+CamCapture is imported (child processes inherit it). The simulated
+cameras produce synthetic Mono8 to Mono16 (incl. packed Mono12) plume images at a configurable
+trigger rate, and can randomly drop triggers or deliver incomplete
+images. Frames that arrive while all stream buffers are held by the
+application are lost, the same as on the real camera.
+
+Settings live in SIM_CONFIG and can be changed with configure(), or with
+LIBSGUI_SIM='trigger_rate=50,pixel_format=Mono12p' in the environment.
+"""
+import os
+import threading
+import queue
+import time
+import numpy as np
+from PIL import Image
+from PixelFormats import pack_mono12
+
+
+SIM_CONFIG = {
+    'num_cameras': 1,
+    'serial_base': 90000000,
+    'trigger_rate': 10.,        # Hz, hardware trigger / free running rate
+    'width': 1280,
+    'height': 1024,
+    'pixel_format': 'Mono8',
+    'incomplete_fraction': 0.,  # fraction of images delivered incomplete
+    'drop_fraction': 0.,        # fraction of triggers that never produce an image
+    'buffer_count': 10,         # stream buffers, like Spinnaker's default
+    'frame_bank': 8,            # distinct synthetic frames generated up front and cycled
+    'seed': None,
+}
+
+
+def configure(**kwargs):
+    """
+    Changes the simulation settings. Applies to cameras created afterwards.
+
+    :param kwargs: Any of the keys in SIM_CONFIG
+    :return: None
+    """
+    for k, v in kwargs.items():
+        if k not in SIM_CONFIG:
+            raise KeyError('Unknown simulation setting %s' % k)
+        SIM_CONFIG[k] = v
+
+
+def _configure_from_environment():
+    for item in os.environ.get('LIBSGUI_SIM', '').split(','):
+        if '=' not in item:
+            continue
+        k, v = (i.strip() for i in item.split('=', 1))
+        default = SIM_CONFIG.get(k)
+        if isinstance(default, (int, float)) and not isinstance(default, bool):
+            v = type(default)(float(v))
+        configure(**{k: v})
+
+
+_configure_from_environment()
+
+
+class SpinnakerException(Exception):
+    pass
+
+
+# access modes
+NI, NA, WO, RO, RW = range(5)
+
+# enumeration entries. Values are unique across enumerations so mixing them up raises like the real SDK
+TriggerMode_Off, TriggerMode_On = 100, 101
+TriggerSelector_FrameStart, TriggerSelector_AcquisitionStart = 110, 111
+TriggerSource_Software, TriggerSource_Line0 = 120, 121
+AcquisitionMode_Continuous, AcquisitionMode_SingleFrame, AcquisitionMode_MultiFrame = 130, 131, 132
+PixelFormat_Mono8, PixelFormat_Mono16, PixelFormat_Mono10, PixelFormat_Mono12 = 140, 141, 142, 143
+PixelFormat_Mono12p, PixelFormat_Mono12Packed = 144, 145
+
+# colour processing algorithms, ignored for mono images
+DEFAULT, NO_COLOR_PROCESSING, NEAREST_NEIGHBOR, HQ_LINEAR = range(4)
+
+# image status
+IMAGE_NO_ERROR, IMAGE_DATA_INCOMPLETE = 0, 5
+
+# pixel format: (name, dtype of the unpacked pixels, significant bits)
+_PIXEL_FORMATS = {PixelFormat_Mono8: ('Mono8', np.uint8, 8),
+                  PixelFormat_Mono10: ('Mono10', np.uint16, 10),
+                  PixelFormat_Mono12: ('Mono12', np.uint16, 12),
+                  PixelFormat_Mono16: ('Mono16', np.uint16, 16),
+                  PixelFormat_Mono12p: ('Mono12p', np.uint16, 12),
+                  PixelFormat_Mono12Packed: ('Mono12Packed', np.uint16, 12)}
+_PACKED = (PixelFormat_Mono12p, PixelFormat_Mono12Packed)
+
+
+class _Node:
+    """
+    A GenICam style node: value, access mode, and for enumerations the valid entries
+    """
+    def __init__(self, name, value=None, access=RW, entries=None, on_set=None, limits=None):
+        self.name = name
+        self.value = value
+        self.access = access
+        self.entries = entries  # {int value: symbolic name} for enumerations
+        self.on_set = on_set
+        self.limits = limits    # callable returning (min, max, increment) for integer nodes
+
+    def GetName(self):
+        return self.name
+
+    def GetAccessMode(self):
+        return self.access
+
+    def GetValue(self):
+        if self.access not in (RO, RW):
+            raise SpinnakerException('Node %s is not readable' % self.name)
+        return self.value
+
+    def SetValue(self, value):
+        if self.access not in (WO, RW):
+            raise SpinnakerException('Node %s is not writable' % self.name)
+        if self.entries is not None and value not in self.entries:
+            raise SpinnakerException('%s is not a valid entry of %s' % (value, self.name))
+        if self.limits is not None:
+            lo, hi, inc = self.limits()
+            if not lo <= value <= hi or (value - lo) % inc:
+                raise SpinnakerException('%s is out of range for %s (%d..%d step %d)' % (value, self.name, lo, hi, inc))
+        if self.on_set is not None:
+            self.on_set(self, value)
+        self.value = value
+
+    def GetIntValue(self):
+        return self.GetValue()
+
+    def GetMin(self):
+        return self.limits()[0] if self.limits else self.value
+
+    def GetMax(self):
+        return self.limits()[1] if self.limits else self.value
+
+    def GetInc(self):
+        return self.limits()[2] if self.limits else 1
+
+    def SetIntValue(self, value):
+        self.SetValue(value)
+
+    def ToString(self):
+        if self.entries is not None:
+            return self.entries[self.value]
+        return str(self.value)
+
+    def FromString(self, text):
+        if self.entries is not None:
+            for k, v in self.entries.items():
+                if v == text:
+                    return self.SetValue(k)
+            raise SpinnakerException('%s is not a valid entry of %s' % (text, self.name))
+        if isinstance(self.value, bool):
+            return self.SetValue(text.strip().lower() in ('1', 'true'))
+        return self.SetValue(type(self.value)(float(text)) if isinstance(self.value, (int, float)) else text)
+
+
+class _Command(_Node):
+    def __init__(self, name, command):
+        super().__init__(name, access=WO)
+        self.command = command
+
+    def Execute(self):
+        if self.access != WO:
+            raise SpinnakerException('Command %s is not executable' % self.name)
+        self.command()
+
+
+class _Category(_Node):
+    def __init__(self, name, features):
+        super().__init__(name, access=RO)
+        self.features = features
+
+    def GetFeatures(self):
+        return list(self.features)
+
+
+class _NodeMap:
+    def __init__(self, nodes):
+        self.nodes = {n.name: n for n in nodes}
+
+    def GetNode(self, name):
+        return self.nodes.get(name)
+
+
+def CCategoryPtr(node):
+    return node
+
+
+def CValuePtr(node):
+    return node
+
+
+def CEnumerationPtr(node):
+    return node
+
+
+def CIntegerPtr(node):
+    return node
+
+
+def CFloatPtr(node):
+    return node
+
+
+def CBooleanPtr(node):
+    return node
+
+
+def CCommandPtr(node):
+    return node
+
+
+def IsAvailable(node):
+    return node is not None and node.access not in (NI, NA)
+
+
+def IsReadable(node):
+    return node is not None and node.access in (RO, RW)
+
+
+def IsWritable(node):
+    return node is not None and node.access in (WO, RW)
+
+
+class ImageEventHandler:
+    """
+    Base class for image event handlers. Override OnImageEvent.
+    """
+    def OnImageEvent(self, image):
+        pass
+
+
+class _Image:
+    """
+    Simulated image. Holds on to one of the camera's stream buffers until released.
+    """
+    def __init__(self, data, pixel_format, frame_id, timestamp, status=IMAGE_NO_ERROR, camera=None, raw=None):
+        self.data = data    # unpacked pixels
+        self.raw = raw      # packed buffer for packed pixel formats
+        self.pixel_format = pixel_format
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.status = status
+        self.camera = camera
+
+    def GetNDArray(self):
+        if self.raw is not None:
+            return self.raw
+        return self.data
+
+    def GetData(self):
+        if self.raw is not None:
+            return self.raw
+        return self.data.reshape(-1).view(np.uint8)
+
+    def GetWidth(self):
+        return self.data.shape[1]
+
+    def GetHeight(self):
+        return self.data.shape[0]
+
+    def GetPixelFormat(self):
+        return self.pixel_format
+
+    def GetPixelFormatName(self):
+        return _PIXEL_FORMATS[self.pixel_format][0]
+
+    def GetBitsPerPixel(self):
+        return _PIXEL_FORMATS[self.pixel_format][2]
+
+    def GetFrameID(self):
+        return self.frame_id
+
+    def GetTimeStamp(self):
+        return self.timestamp
+
+    def GetImageStatus(self):
+        return self.status
+
+    def IsIncomplete(self):
+        return self.status != IMAGE_NO_ERROR
+
+    def Convert(self, pixel_format, algorithm=DEFAULT):
+        if pixel_format not in _PIXEL_FORMATS or pixel_format in _PACKED:
+            raise SpinnakerException('Unsupported pixel format %s' % pixel_format)
+        src_bits = _PIXEL_FORMATS[self.pixel_format][2]
+        dst_bits = _PIXEL_FORMATS[pixel_format][2]
+        dtype = _PIXEL_FORMATS[pixel_format][1]
+        if dst_bits < src_bits:
+            data = (self.data >> (src_bits - dst_bits)).astype(dtype)
+        else:
+            data = self.data.astype(dtype) << (dst_bits - src_bits)
+        return _Image(data, pixel_format, self.frame_id, self.timestamp, self.status)
+
+    def Save(self, filename):
+        Image.fromarray(self.data).save(filename)
+
+    def Release(self):
+        if self.camera is not None:
+            self.camera._release_buffer()
+            self.camera = None
+
+
+class Camera:
+    """
+    Simulated Blackfly S. Nodes are reachable as attributes (cam.TriggerMode) and through GetNodeMap().
+    """
+    def __init__(self, serial):
+        self.serial = str(serial)
+        self.initialized = False
+        self.streaming = False
+        self.lock = threading.Lock()
+        self.buffer_queue = None
+        self.buffers_in_use = 0
+        self.handlers = []
+        self.thread = None
+        self.stopping = threading.Event()
+        self.frame_id = 0
+        self.bank = None
+        self.rng = np.random.default_rng(SIM_CONFIG['seed'])
+        self.config = dict(SIM_CONFIG)
+        self.stats = {'triggers': 0, 'dropped_triggers': 0, 'incomplete': 0, 'buffer_overflows': 0,
+                      'delivered': 0}
+
+        w, h = self.config['width'], self.config['height']
+        pixel_format = {v[0]: k for k, v in _PIXEL_FORMATS.items()}.get(self.config['pixel_format'],
+                                                                         PixelFormat_Mono8)
+        nodes = [
+            _Node('TriggerMode', TriggerMode_Off, entries={TriggerMode_Off: 'Off', TriggerMode_On: 'On'}),
+            _Node('TriggerSelector', TriggerSelector_FrameStart,
+                  entries={TriggerSelector_FrameStart: 'FrameStart',
+                           TriggerSelector_AcquisitionStart: 'AcquisitionStart'}),
+            _Node('TriggerSource', TriggerSource_Software,
+                  entries={TriggerSource_Software: 'Software', TriggerSource_Line0: 'Line0'}),
+            _Command('TriggerSoftware', self._software_trigger),
+            _Node('AcquisitionMode', AcquisitionMode_Continuous,
+                  entries={AcquisitionMode_Continuous: 'Continuous', AcquisitionMode_SingleFrame: 'SingleFrame',
+                           AcquisitionMode_MultiFrame: 'MultiFrame'}),
+            _Node('AcquisitionFrameRate', float(self.config['trigger_rate'])),
+            _Node('ExposureTime', 14632.),
+            _Node('Gain', 17.83),
+            _Node('PixelFormat', pixel_format, entries={k: v[0] for k, v in _PIXEL_FORMATS.items()}),
+            _Node('SensorWidth', w, access=RO),
+            _Node('SensorHeight', h, access=RO),
+            _Node('WidthMax', w, access=RO),
+            _Node('HeightMax', h, access=RO),
+            # ROI is in binned/decimated pixels, like on the Blackfly S
+            _Node('Width', w, limits=lambda: (8, self.WidthMax.value - self.OffsetX.value, 4)),
+            _Node('Height', h, limits=lambda: (8, self.HeightMax.value - self.OffsetY.value, 2)),
+            _Node('OffsetX', 0, limits=lambda: (0, self.WidthMax.value - self.Width.value, 4)),
+            _Node('OffsetY', 0, limits=lambda: (0, self.HeightMax.value - self.Height.value, 2)),
+            _Node('BinningHorizontal', 1, limits=lambda: (1, 4, 1), on_set=self._scale_sensor),
+            _Node('BinningVertical', 1, limits=lambda: (1, 4, 1), on_set=self._scale_sensor),
+            _Node('DecimationHorizontal', 1, limits=lambda: (1, 4, 1), on_set=self._scale_sensor),
+            _Node('DecimationVertical', 1, limits=lambda: (1, 4, 1), on_set=self._scale_sensor),
+        ]
+        self.nodemap = _NodeMap(nodes)
+        info = [
+            _Node('DeviceVendorName', 'FLIR', access=RO),
+            _Node('DeviceModelName', 'Simulated Blackfly S BFS-U3-13Y3M', access=RO),
+            _Node('DeviceSerialNumber', self.serial, access=RO),
+        ]
+        self.tl_nodemap = _NodeMap(info + [_Category('DeviceInformation', info)])
+        self.TLDevice = _Attributes(self.tl_nodemap)
+
+    def __getattr__(self, name):
+        # only called for attributes that aren't set normally, i.e. camera nodes
+        nodemap = self.__dict__.get('nodemap')
+        if nodemap is not None and name in nodemap.nodes:
+            return nodemap.nodes[name]
+        raise AttributeError(name)
+
+    def _scale_sensor(self, node, value):
+        """
+        Binning or decimation changed: shrinks the maximum image size and clamps the ROI into it, as the camera does
+
+        :return: None
+        """
+        factors = {n: getattr(self, n).value for n in ('BinningHorizontal', 'BinningVertical',
+                                                      'DecimationHorizontal', 'DecimationVertical')}
+        factors[node.name] = value
+        self.WidthMax.value = self.SensorWidth.value // (factors['BinningHorizontal'] * factors['DecimationHorizontal'])
+        self.HeightMax.value = self.SensorHeight.value // (factors['BinningVertical'] * factors['DecimationVertical'])
+        self.OffsetX.value = self.OffsetY.value = 0
+        self.Width.value = min(self.Width.value, self.WidthMax.value)
+        self.Height.value = min(self.Height.value, self.HeightMax.value)
+
+    def GetTLDeviceNodeMap(self):
+        return self.tl_nodemap
+
+    def GetNodeMap(self):
+        if not self.initialized:
+            raise SpinnakerException('Camera is not initialized')
+        return self.nodemap
+
+    def Init(self):
+        self.initialized = True
+
+    def DeInit(self):
+        if self.streaming:
+            self.EndAcquisition()
+        self.initialized = False
+
+    def IsInitialized(self):
+        return self.initialized
+
+    def IsStreaming(self):
+        return self.streaming
+
+    def RegisterEventHandler(self, handler):
+        self.handlers.append(handler)
+
+    def UnregisterEventHandler(self, handler):
+        if handler not in self.handlers:
+            raise SpinnakerException('Event handler is not registered')
+        self.handlers.remove(handler)
+
+    def _make_bank(self):
+        """
+        Generates a few synthetic plume images to cycle through, so frame generation costs nothing per trigger
+
+        :return: None
+        """
+        name, dtype, bits = _PIXEL_FORMATS[self.PixelFormat.value]
+        h, w = self.Height.value, self.Width.value
+        y, x = np.ogrid[:h, :w]
+        full = (1 << bits) - 1
+        self.bank = []
+        for _ in range(max(1, int(self.config['frame_bank']))):
+            cx = w / 2 + self.rng.normal(0, w / 40)
+            cy = h / 2 + self.rng.normal(0, h / 40)
+            sx = w / 12 * self.rng.uniform(0.7, 1.3)
+            sy = h / 8 * self.rng.uniform(0.7, 1.3)
+            plume = self.rng.uniform(0.4, 1.1) * np.exp(-((x - cx) ** 2 / (2 * sx ** 2) + (y - cy) ** 2 / (2 * sy ** 2)))
+            noise = self.rng.normal(0.02, 0.01, (h, w))
+            frame = (np.clip(plume + noise, 0, 1) * full).astype(dtype)
+            raw = pack_mono12(frame, name) if self.PixelFormat.value in _PACKED else None
+            # the same frames are handed out again and again, so nobody gets to modify them
+            frame.setflags(write=False)
+            if raw is not None:
+                raw.setflags(write=False)
+            self.bank.append((frame, raw))
+
+    def BeginAcquisition(self):
+        if not self.initialized:
+            raise SpinnakerException('Camera is not initialized')
+        if self.streaming:
+            raise SpinnakerException('Camera is already streaming')
+        self._make_bank()
+        self.buffer_queue = queue.Queue()
+        self.buffers_in_use = 0
+        self.stopping.clear()
+        self.streaming = True
+        # free running or hardware triggered cameras produce images on their own
+        if self.TriggerMode.value == TriggerMode_Off or self.TriggerSource.value != TriggerSource_Software:
+            self.thread = threading.Thread(target=self._trigger_loop, name='SimTrigger-%s' % self.serial,
+                                           daemon=True)
+            self.thread.start()
+
+    def EndAcquisition(self):
+        if not self.streaming:
+            raise SpinnakerException('Camera is not streaming')
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.streaming = False
+
+    def _trigger_loop(self):
+        """
+        Fires triggers at the configured rate until acquisition ends
+
+        :return: None
+        """
+        period = 1. / float(self.config['trigger_rate'])
+        next_t = time.perf_counter()
+        while not self.stopping.is_set():
+            next_t += period
+            delay = next_t - time.perf_counter()
+            if delay > 0 and self.stopping.wait(delay):
+                break
+            self._trigger()
+
+    def _software_trigger(self):
+        if not self.streaming:
+            raise SpinnakerException('Camera is not streaming')
+        self._trigger()
+
+    def _trigger(self):
+        """
+        One trigger: produce an image if a stream buffer is free and deliver it to the handlers or the buffer queue
+
+        :return: None
+        """
+        with self.lock:
+            self.stats['triggers'] += 1
+            if self.rng.random() < self.config['drop_fraction']:
+                self.stats['dropped_triggers'] += 1
+                return
+            # the camera exposes the frame and counts it even if there's no buffer to put it in
+            self.frame_id += 1
+            frame_id = self.frame_id
+            if self.buffers_in_use >= self.config['buffer_count']:
+                self.stats['buffer_overflows'] += 1
+                return
+            self.buffers_in_use += 1
+            status = IMAGE_NO_ERROR
+            if self.rng.random() < self.config['incomplete_fraction']:
+                status = IMAGE_DATA_INCOMPLETE
+                self.stats['incomplete'] += 1
+            self.stats['delivered'] += 1
+        data, raw = self.bank[frame_id % len(self.bank)]
+        image = _Image(data, self.PixelFormat.value, frame_id, time.perf_counter_ns(), status, camera=self, raw=raw)
+        if self.handlers:
+            # event handler images are released by the SDK once the callback returns
+            for handler in list(self.handlers):
+                handler.OnImageEvent(image)
+            image.Release()
+        else:
+            self.buffer_queue.put(image)
+
+    def _release_buffer(self):
+        with self.lock:
+            self.buffers_in_use -= 1
+
+    def GetNextImage(self, timeout=None):
+        """
+        :param timeout: ms to wait for an image, None waits forever
+        :return: Next image, which must be released
+        """
+        if not self.streaming:
+            raise SpinnakerException('Camera is not streaming')
+        try:
+            return self.buffer_queue.get(timeout=None if timeout is None else timeout / 1000.)
+        except queue.Empty:
+            raise SpinnakerException('Failed waiting for EventData on NEW_BUFFER_DATA event. [-1011]')
+
+    def sim_stats(self):
+        """
+        :return: dict of trigger, drop, incomplete and buffer overflow counts for this camera
+        """
+        with self.lock:
+            return dict(self.stats)
+
+
+class _Attributes:
+    """
+    Attribute style access to a nodemap, like cam.TLDevice.DeviceSerialNumber
+    """
+    def __init__(self, nodemap):
+        self._nodemap = nodemap
+
+    def __getattr__(self, name):
+        node = self._nodemap.GetNode(name)
+        if node is None:
+            raise AttributeError(name)
+        return node
+
+
+class CameraList:
+    def __init__(self, cameras):
+        self.cameras = list(cameras)
+
+    def GetSize(self):
+        return len(self.cameras)
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def __iter__(self):
+        return iter(list(self.cameras))
+
+    def __getitem__(self, i):
+        return self.cameras[i]
+
+    def GetByIndex(self, i):
+        return self.cameras[i]
+
+    def GetBySerial(self, serial):
+        for cam in self.cameras:
+            if cam.serial == str(serial):
+                return cam
+        raise SpinnakerException('No camera with serial number %s' % serial)
+
+    def Clear(self):
+        self.cameras = []
+
+
+class System:
+    _instance = None
+
+    @classmethod
+    def GetInstance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+            cls._instance.cameras = [Camera(SIM_CONFIG['serial_base'] + i) for i in range(SIM_CONFIG['num_cameras'])]
+        return cls._instance
+
+    def GetCameras(self):
+        return CameraList(self.cameras)
+
+    def ReleaseInstance(self):
+        System._instance = None
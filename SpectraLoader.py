@@ -0,0 +1,80 @@
+import os
+import numpy as np
+from ShotManifest import MANIFEST_DIR
+
+# parsed spectra are cached as .npy next to the text files, in <spectra dir>/.libsgui/spectra/
+SPECTRA_CACHE_DIR = os.path.join(MANIFEST_DIR, 'spectra')
+_NUMBER_START = '0123456789+-.'
+
+
+def _numeric(line):
+    """
+    :param line: One line of a spectrum file
+    :return: True if it is a row of numbers rather than a header or footer line
+    """
+    line = line.lstrip()
+    return bool(line) and line[0] in _NUMBER_START
+
+
+def parse_spectrum(path, delimiter=';'):
+    """
+    Parses a spectrometer text file of delimiter separated columns (wavelength;intensity[;...]).
+    Header lines before the first numeric line and footer lines after the last one are skipped.
+
+    Parsing is left to np.loadtxt. It is only done once per file, after that load_spectrum reads the
+    binary sidecar.
+
+    :param path: Spectrum file
+    :param delimiter: Column separator
+    :return: (rows, columns) float64 array
+    """
+    with open(path, encoding='latin-1') as f:
+        lines = f.read().splitlines()
+    start = 0
+    while start < len(lines) and not _numeric(lines[start]):
+        start += 1
+    end = len(lines)
+    while end > start and not _numeric(lines[end - 1]):
+        end -= 1
+    if start == end:
+        return np.empty((0, 2))
+    # a trailing delimiter leaves an empty last column, leave it out
+    columns = len([i for i in lines[start].split(delimiter) if i.strip()])
+    return np.loadtxt(lines[start:end], delimiter=delimiter, usecols=range(columns), ndmin=2, dtype=np.float64)
+
+
+def _sidecar(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, SPECTRA_CACHE_DIR, name + '.npy')
+
+
+def load_spectrum(path, cache=True):
+    """
+    Loads a spectrum, from its binary sidecar if it is up to date, otherwise by parsing the text file and
+    writing the sidecar for next time. The sidecar carries the text file's mtime, so an overwritten
+    spectrum is parsed again.
+
+    :param path: Spectrum file
+    :param cache: Use and write the sidecar cache
+    :return: (rows, columns) float64 array, memory mapped when it came from the cache
+    """
+    if not cache:
+        return parse_spectrum(path)
+    mtime = os.stat(path).st_mtime_ns
+    sidecar = _sidecar(path)
+    try:
+        if os.stat(sidecar).st_mtime_ns == mtime:
+            return np.load(sidecar, mmap_mode='r')
+    except (OSError, ValueError):
+        pass
+    data = parse_spectrum(path)
+    try:
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        tmp = sidecar + '.tmp.npy'
+        np.save(tmp, data)
+        # stamp the sidecar with the source's mtime, that's what makes it valid
+        os.utime(tmp, ns=(mtime, mtime))
+        os.replace(tmp, sidecar)
+    except OSError as e:
+        print('Could not cache spectrum %s: %s' % (path, e))
+    return data
@@ -0,0 +1,191 @@
+import os
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from PixelFormats import to_preview
+from ShotManifest import MANIFEST_DIR
+
+# decoded thumbnails kept around, a few screens' worth
+THUMBNAIL_CACHE_SIZE = 20
+# thumbnails written next to the shots as they are saved, in <image dir>/.libsgui/thumbs/, as JPEGs already at
+# the viewer's display scale, 448x358 and a few tens of kB at most for a 1280x1024 frame.
+THUMBNAIL_DIR = os.path.join(MANIFEST_DIR, 'thumbs')
+THUMBNAIL_SCALE = 0.35
+THUMBNAIL_QUALITY = 85
+
+
+def load_preview(path):
+    """
+    Opens an image file for display, bringing 16 bit shots down to 8 bits
+
+    :param path: Image file
+    :return: PIL image
+    """
+    image = Image.open(path)
+    if image.mode not in ('L', 'RGB'):
+        # 16 bit shots from the native pixel path, scaled down to 8 bits for display
+        image = Image.fromarray(to_preview(np.array(image)))
+    return image
+
+
+def block_reduce(frame, factor):
+    """
+    Shrinks a frame by an integer factor, averaging each factor x factor block. Rows and columns that don't
+    fill a whole block are dropped.
+
+    :param frame: 2D unsigned integer array
+    :param factor: Reduction factor
+    :return: Reduced array, same dtype as the frame
+    """
+    h, w = frame.shape
+    h -= h % factor
+    w -= w % factor
+    acc = np.zeros((h // factor, w // factor), np.uint32)
+    for i in range(factor):
+        for j in range(factor):
+            acc += frame[i:h:factor, j:w:factor]
+    acc //= factor * factor
+    return acc.astype(frame.dtype)
+
+
+def preview_frame(frame, scale):
+    """
+    Scales a frame for display, block reducing it first so the final resample only sees a small image
+
+    :param frame: 2D array
+    :param scale: Scale factor
+    :return: PIL image
+    """
+    factor = max(1, int(1 / scale))
+    size = (int(frame.shape[1] * scale), int(frame.shape[0] * scale))
+    if factor > 1:
+        frame = block_reduce(frame, factor)
+    return Image.fromarray(to_preview(frame)).resize(size, Image.LANCZOS)
+
+
+def thumbnail_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, THUMBNAIL_DIR, name + '.jpg')
+
+
+def write_thumbnail(frame, path, bits=None, scale=THUMBNAIL_SCALE):
+    """
+    Stores a small 8 bit JPEG of a frame that has just been saved, so the viewer doesn't have to decode the
+    whole file. The thumbnail carries the frame file's mtime and is ignored once the file changes.
+
+    :param frame: 2D array that was saved
+    :param path: File it was saved to
+    :param bits: Significant bits of the frame, see PixelFormats.to_preview
+    :param scale: Scale factor relative to the frame, the viewer's display scale
+    :return: None
+    """
+    factor = max(1, int(1 / scale))
+    size = (max(1, int(frame.shape[1] * scale)), max(1, int(frame.shape[0] * scale)))
+    thumb = Image.fromarray(to_preview(block_reduce(frame, factor), bits)).resize(size, Image.LANCZOS)
+    mtime = os.stat(path).st_mtime_ns
+    thumb_path = thumbnail_path(path)
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    tmp = thumb_path + '.tmp'
+    thumb.save(tmp, 'JPEG', quality=THUMBNAIL_QUALITY)
+    os.utime(tmp, ns=(mtime, mtime))
+    os.replace(tmp, thumb_path)
+
+
+def prune_thumbnails(directory):
+    """
+    Deletes thumbnails whose shot is no longer in the directory
+
+    :param directory: Image directory
+    :return: Number of thumbnails deleted
+    """
+    thumbs = os.path.join(directory, THUMBNAIL_DIR)
+    try:
+        names = os.listdir(thumbs)
+    except FileNotFoundError:
+        return 0
+    shots = set(os.listdir(directory))
+    pruned = 0
+    for name in names:
+        # a leftover .tmp from an interrupted write goes too
+        if name[:-len('.jpg')] not in shots or not name.endswith('.jpg'):
+            try:
+                os.remove(os.path.join(thumbs, name))
+                pruned += 1
+            except OSError:
+                pass
+    return pruned
+
+
+def load_thumbnail(path, scale):
+    """
+    Opens an image file for display at a reduced scale, decoding as little of it as possible: the thumbnail
+    written with the shot if it is up to date, otherwise a reduced decode (JPEG) or an integer block reduction
+    of the decoded file before the final resample. Use load_preview for full resolution.
+
+    :param path: Image file
+    :param scale: Scale factor relative to the full frame
+    :return: PIL image
+    """
+    factor = max(1, int(1 / scale))
+    image = Image.open(path)
+    size = (int(image.size[0] * scale), int(image.size[1] * scale))
+    try:
+        thumb_path = thumbnail_path(path)
+        if os.stat(thumb_path).st_mtime_ns == os.stat(path).st_mtime_ns:
+            thumb = Image.open(thumb_path)
+            thumb.load()
+            # written at the display scale already, unless the viewer's scale has been changed since
+            return thumb if thumb.size == size else thumb.resize(size, Image.LANCZOS)
+    except (OSError, ValueError):
+        pass
+    if image.format == 'JPEG':
+        # the decoder scales by 1/2, 1/4 or 1/8 on its own, staying at least as large as size
+        image.draft(image.mode, size)
+    elif factor > 1 and image.mode in ('L', 'RGB'):
+        image = image.reduce(factor)
+    elif factor > 1:
+        return preview_frame(np.array(image), scale)
+    if image.mode not in ('L', 'RGB'):
+        image = Image.fromarray(to_preview(np.array(image)))
+    return image.resize(size, Image.LANCZOS)
+
+
+class ThumbnailCache:
+    """
+    Bounded LRU cache of scaled thumbnails, as PIL images in the viewer's
+    worker and as ready to display ImageTk.PhotoImages on the Tk side.
+
+    File thumbnails are keyed by (path, mtime, scale), so a file that is
+    rewritten gets decoded again and everything else is decoded once. The
+    least recently shown thumbnails are dropped once max_items is reached,
+    which caps memory no matter how many shots the viewer has gone through.
+    """
+    def __init__(self, max_items=THUMBNAIL_CACHE_SIZE):
+        """
+        :param max_items: Number of thumbnails to keep
+        """
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, make):
+        """
+        :param key: Hashable key identifying the thumbnail
+        :param make: Called without arguments to build the thumbnail on a miss
+        :return: Thumbnail
+        """
+        try:
+            photo = self.items[key]
+        except KeyError:
+            self.misses += 1
+            photo = self.items[key] = make()
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+        else:
+            self.hits += 1
+            self.items.move_to_end(key)
+        return photo
+
+    def clear(self):
+        self.items.clear()
@@ -0,0 +1,281 @@
+import os
+import queue
+import threading
+import numpy as np
+from DirectoryIndex import DirectoryIndex
+from SharedFrames import SharedFrameRing
+from ThumbnailCache import ThumbnailCache, load_thumbnail, preview_frame, prune_thumbnails, thumbnail_path
+from SpectraLoader import load_spectrum
+from FrameStats import format_stats
+from PairingIndex import PairingIndex
+from LineID import LineTable, identify
+
+# Identify emission lines in every new spectrum (see LineID), shown with the spectrum
+LINE_ID = True
+
+
+class ViewerUpdate:
+    """
+    Everything the viewer needs to show one refresh, ready to put on screen.
+
+    shots holds one (image, spectrum) pair per display row, newest first, starting
+    first shots down from the newest of the total in the run. image is
+    (name, header text, cache key, scaled PIL image) and spectrum is
+    (path, (rows, 2) array, LineID.LineReport or None), either None if that shot
+    doesn't have one (yet). The PIL image or the array is None if the file
+    couldn't be read.
+    unmatched is (shots with only an image, shots with only a spectrum).
+    """
+    def __init__(self, generation, shots, unmatched=(0, 0), first=0, total=0):
+        self.generation = generation
+        self.shots = shots
+        self.unmatched = unmatched
+        self.first = first
+        self.total = total
+
+
+class ViewerWorker(threading.Thread):
+    """
+    Does the viewer's slow work off the Tk thread: directory listing, live frame polling, image decoding and
+    resizing, and spectrum parsing.
+
+    The Tk side calls request() whenever it wants fresh data and picks up finished
+    ViewerUpdates with latest() from an after() callback. Requests that pile up
+    while the worker is busy collapse into one. Work for a request that has been
+    overtaken by a newer one is abandoned or dropped, so the screen never goes
+    back to older shots. Only PhotoImage creation and drawing stay on the Tk
+    thread, as Tk requires.
+    """
+    def __init__(self, image_dir, spectra_dir, num_images, shared_frames=None, scale=0.35, pairing=None,
+                 file_extension=None):
+        """
+        :param image_dir: Image directory
+        :param spectra_dir: Spectra directory
+        :param num_images: Number of newest shots to prepare
+        :param shared_frames: Name of the camera's live frame shared memory, None if there isn't one
+        :param scale: Thumbnail scale factor
+        :param pairing: PairingIndex matching images to spectra, one with the PairingIndex defaults if None
+        :param file_extension: Only show image files with this extension, e.g. 'png'. None shows every file.
+        """
+        super().__init__(name='ViewerWorker', daemon=True)
+        self.image_dir = image_dir
+        self.spectra_dir = spectra_dir
+        self.num_images = num_images
+        self.shared_frames_name = shared_frames
+        self.shared_frames = None
+        self.scale = scale
+        self.file_extension = '.' + file_extension.lstrip('.').lower() if file_extension else None
+        self.image_index = None
+        self.spectra_index = None
+        self.pairing = pairing if pairing is not None else PairingIndex()
+        self.lines = None
+        if LINE_ID:
+            try:
+                self.lines = LineTable.load()
+            except (OSError, ValueError) as e:
+                print('No line identification, could not load the line table: %s' % e)
+        # scaled PIL images and parsed spectra, keyed like the viewer's PhotoImage cache. Big enough to scroll
+        # back and forth over a few screens without decoding again
+        self.previews = ThumbnailCache(8 * num_images)
+        self.spectra = ThumbnailCache(8 * num_images)
+        self.results = queue.Queue()
+        self.wake = threading.Event()
+        self.stopping = False
+        self.lock = threading.Lock()
+        self.wanted = 0
+        self.first = 0
+        self.last = None
+
+    def request(self, first=None):
+        """
+        Asks for a refresh. Called from the Tk thread.
+
+        :param first: Number of newer shots to skip, 0 to follow the newest. None keeps the current position.
+        :return: Generation number the refresh will carry
+        """
+        with self.lock:
+            if first is not None:
+                self.first = first
+            self.wanted += 1
+            generation = self.wanted
+        self.wake.set()
+        return generation
+
+    def latest(self):
+        """
+        Called from the Tk thread.
+
+        :return: Newest finished ViewerUpdate, or None. Older finished ones are dropped.
+        """
+        update = None
+        while True:
+            try:
+                update = self.results.get_nowait()
+            except queue.Empty:
+                return update
+
+    def stale(self, generation):
+        return self.stopping or generation < self.wanted
+
+    def run(self):
+        # the indices do their first full listing here rather than holding up the window
+        self.image_index = DirectoryIndex(self.image_dir)
+        self.spectra_index = DirectoryIndex(self.spectra_dir)
+        # thumbnails of shots deleted while the viewer wasn't running. Here rather than at camera start, which
+        # mustn't depend on the size of the directory
+        pruned = prune_thumbnails(self.image_dir)
+        if pruned:
+            print('Pruned %d thumbnails of deleted shots' % pruned)
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if self.stopping:
+                break
+            generation = self.wanted
+            try:
+                update = self._build(generation)
+            except Exception as e:
+                print(e)
+                continue
+            # a finished update is the newest data there is, even if more requests came in meanwhile
+            if update is not None:
+                self.results.put(update)
+        self.image_index.close()
+        self.spectra_index.close()
+        if self.shared_frames is not None:
+            self.shared_frames.close()
+            self.shared_frames = None
+
+    def _live_frames(self):
+        """
+        :return: List of (shot, name, header, key, frame) for the newest live frames, newest first. Empty if the
+                 camera isn't publishing.
+        """
+        if not self.shared_frames_name:
+            return []
+        if self.shared_frames is not None and self.shared_frames.is_closed():
+            # the camera stopped. Let go of its block, a restarted camera creates a new one under the same name
+            self.shared_frames.close()
+            self.shared_frames = None
+        if self.shared_frames is None:
+            self.shared_frames = SharedFrameRing.attach(self.shared_frames_name)
+            if self.shared_frames is None:
+                return []
+        frames = self.shared_frames.latest(self.num_images)
+        # image statistics computed by the camera process, shown under the frame name
+        stats = {seq: format_stats(s) for seq, shot, s in self.shared_frames.latest_stats(self.num_images)}
+        out = []
+        for seq, shot, frame in frames:
+            name = 'Shot %d (live)' % shot
+            header = name + ('\n' + stats[seq] if stats.get(seq) else '')
+            out.append((shot, name, header, ('live', name, seq, self.scale), frame))
+        return out
+
+    def _rows(self, first):
+        """
+        Works out what goes in each display row
+
+        :param first: Number of newer shots to skip
+
+        :return: List of (image loader or None, spectrum path or None) per row, newest first. An image loader is
+                 (name, header, key, callable returning the scaled PIL image).
+        """
+        self.image_index.refresh()
+        self.spectra_index.refresh()
+        image_changes = self.image_index.changes()
+        for path, mtime in image_changes.items():
+            if mtime is None:
+                # the shot was deleted, its thumbnail goes with it
+                try:
+                    os.remove(thumbnail_path(path))
+                except OSError:
+                    pass
+        if self.file_extension is not None:
+            # other files in the image directory (run files, exports, ...) aren't shots to pair
+            image_changes = {path: mtime for path, mtime in image_changes.items()
+                             if path.lower().endswith(self.file_extension)}
+        self.pairing.update(image_changes, self.spectra_index.changes())
+        # live frames only when showing the newest shots, not while browsing the history
+        live = self._live_frames() if first == 0 else []
+        if live:
+            # newest frames straight from the camera, no need to go through the image files. Their spectra are
+            # looked up by shot number. A frame is published before its image is saved and paired, so its spectrum
+            # only shows up once that has happened
+            rows = []
+            for shot, name, header, key, frame in live:
+                paired = self.pairing.get(shot)
+                rows.append(((name, header, key, lambda frame=frame: preview_frame(frame, self.scale)),
+                             paired.spectrum if paired is not None else None))
+            return rows
+        rows = []
+        for paired in reversed(self.pairing.window(first, self.num_images)):
+            image = None
+            if paired.image is not None:
+                path = paired.image
+                key = (path, paired.image_time, self.scale)
+                image = (path, os.path.basename(path), key, lambda path=path: load_thumbnail(path, self.scale))
+            rows.append((image, paired.spectrum))
+        return rows
+
+    def _build(self, generation):
+        """
+        Prepares one refresh
+
+        :param generation: Generation of the request being served
+        :return: ViewerUpdate, or None if nothing changed or a newer request came in meanwhile
+        """
+        first = self.first
+        rows = self._rows(first)
+        # nothing new since the last update
+        newest = (first, len(self.pairing), [(image[2] if image else None, spectrum) for image, spectrum in rows])
+        if newest == self.last:
+            return None
+
+        shots = []
+        for image, spectrum in rows:
+            if self.stale(generation):
+                return None
+            if image is not None:
+                name, header, key, load = image
+                try:
+                    # reduced decode, full resolution is only loaded when a shot is zoomed into
+                    image = (name, header, key, self.previews.get(key, load))
+                except Exception as e:
+                    # one unreadable shot only blanks its own row
+                    print('Could not load %s: %s' % (name, e))
+                    image = (name, '%s\nCould not load image' % header, key, None)
+            if spectrum is not None:
+                try:
+                    key = (spectrum, os.stat(spectrum).st_mtime)
+                    spectrum = (spectrum,) + self.spectra.get(key, lambda path=spectrum: self._load_spectrum(path))
+                except FileNotFoundError:
+                    spectrum = None
+                except Exception as e:
+                    print('Could not load %s: %s' % (spectrum, e))
+                    spectrum = (spectrum, None, None)
+            shots.append((image, spectrum))
+        self.last = newest
+        only_image, only_spectrum = self.pairing.unmatched()
+        return ViewerUpdate(generation, shots, (len(only_image), len(only_spectrum)), first, len(self.pairing))
+
+    def _load_spectrum(self, path):
+        """
+        :param path: Spectrum file
+        :return: (data, LineReport or None)
+        """
+        # copied out of the memory map so the Tk thread never waits on the disk
+        dat = np.array(load_spectrum(path))
+        report = None
+        if self.lines is not None and dat.ndim == 2 and dat.shape[1] >= 2:
+            report = identify(dat[:, 0], dat[:, 1], self.lines)
+        return dat, report
+
+    def stop(self):
+        """
+        Stops the worker and releases the directory watchers and shared memory
+
+        :return: None
+        """
+        self.stopping = True
+        self.wake.set()
+        self.join(2.)
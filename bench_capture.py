@@ -0,0 +1,193 @@
+"""
+Throughput and latency benchmark for the capture pipeline in CamCapture.
+
+Runs acquire_images against the simulated camera (SimSpin) for every
+combination of file format and writer configuration, and reports sustained
+frames/s, dropped and incomplete frame counts, and p50/p99 grab-to-disk
+latency. Results are written as JSON so runs from different versions can be
+compared with --compare.
+
+Example:
+    python bench_capture.py --rate 60 --duration 10 --extensions png,bmp,raw,h5 --writers 1,2,4 -o bench.json
+"""
+import os
+# must be set before CamCapture is imported
+os.environ['LIBSGUI_CAMERA'] = 'sim'
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import shutil
+import threading
+import contextlib
+import subprocess
+import SimSpin
+import CamCapture
+
+
+def run_one(extension, num_writers, writer_queue_size, ring_size, rate, duration, event_driven,
+            capture_profile=CamCapture.CAPTURE_PROFILE):
+    """
+    Captures from the simulated camera for a fixed time with one configuration
+
+    :param extension: File format to save as
+    :param num_writers: Writer threads
+    :param writer_queue_size: Writer queue depth
+    :param ring_size: Frame ring size, 0 for the Spinnaker convert path
+    :param rate: Trigger rate in Hz
+    :param duration: Seconds to capture for
+    :param event_driven: Use the image event handler instead of polling
+    :param capture_profile: Sensor readout profile from CamCapture.CAPTURE_PROFILES
+    :return: dict of results
+    """
+    SimSpin.configure(trigger_rate=rate, num_cameras=1)
+    # grab the simulated camera before main does so its counters can be read after main releases the system
+    cam = SimSpin.System.GetInstance().GetCameras()[0]
+    twd = tempfile.mkdtemp(prefix='libsgui-bench-')
+    stats = {}
+    stop = threading.Event()
+    timer = threading.Timer(duration, stop.set)
+    try:
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            timer.start()
+            CamCapture.main(twd, extension, num_writers=num_writers, writer_queue_size=writer_queue_size,
+                            ring_size=ring_size, event_driven=event_driven, stop_event=stop, stats=stats,
+                            capture_profile=capture_profile)
+    finally:
+        timer.cancel()
+        shutil.rmtree(twd, ignore_errors=True)
+    sim = cam.sim_stats()
+    elapsed = stats.get('elapsed') or duration
+    return {
+        'extension': extension,
+        'num_writers': num_writers,
+        'writer_queue_size': writer_queue_size,
+        'ring_size': ring_size,
+        'event_driven': event_driven,
+        'capture_profile': capture_profile,
+        'trigger_rate': rate,
+        'duration': elapsed,
+        'triggers': sim['triggers'],
+        'frames_written': stats.get('written', 0),
+        'sustained_fps': stats.get('written', 0) / elapsed,
+        'incomplete': sim['incomplete'],
+        'dropped': {
+            'trigger': sim['dropped_triggers'],
+            'camera_buffer': sim['buffer_overflows'],
+            'ring': stats.get('ring_overruns', 0),
+            'writer_queue': stats.get('dropped', 0),
+            'write_failed': stats.get('failed', 0),
+        },
+        'writer_high_water': stats.get('high_water', 0),
+        'latency_p50_ms': _ms(stats.get('latency', {}).get(50)),
+        'latency_p99_ms': _ms(stats.get('latency', {}).get(99)),
+        # per frame statistics run inside the grab loop, so they have to fit in the trigger period
+        'frame_stats_p50_ms': _ms(stats.get('frame_stats_time', {}).get(50)),
+        'frame_stats_p99_ms': _ms(stats.get('frame_stats_time', {}).get(99)),
+        'frame_budget_ms': 1000. / rate,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000.
+
+
+def _version():
+    """
+    :return: git commit of the working tree, or None outside a git checkout
+    """
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """
+    Flags configurations whose sustained frame rate dropped by more than tolerance against a baseline run
+
+    :param results: Results of this run
+    :param baseline: Results of a previous run
+    :param tolerance: Allowed fractional drop, e.g. 0.1
+    :return: List of regression messages
+    """
+    def key(r):
+        return (r['extension'], r['num_writers'], r['writer_queue_size'], r['ring_size'], r['event_driven'],
+                r.get('capture_profile', 'full'))
+
+    old = {key(r): r for r in baseline['results']}
+    regressions = []
+    for r in results['results']:
+        b = old.get(key(r))
+        if b is None or not b['sustained_fps']:
+            continue
+        change = r['sustained_fps'] / b['sustained_fps'] - 1
+        if change < -tolerance:
+            regressions.append('%s: %.1f -> %.1f frames/s (%+.0f%%)' % (
+                '/'.join(str(i) for i in key(r)), b['sustained_fps'], r['sustained_fps'], 100 * change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CamCapture pipeline against a simulated camera')
+    parser.add_argument('--extensions', default='png,bmp,raw,h5', help='comma separated file formats to test')
+    parser.add_argument('--writers', default='1,2,4', help='comma separated writer thread counts to test')
+    parser.add_argument('--queue-size', type=int, default=CamCapture.WRITER_QUEUE_SIZE)
+    parser.add_argument('--ring-size', type=int, default=CamCapture.RING_SIZE)
+    parser.add_argument('--profiles', default=CamCapture.CAPTURE_PROFILE,
+                        help='comma separated capture profiles to test, see CamCapture.CAPTURE_PROFILES')
+    parser.add_argument('--rate', type=float, default=50., help='trigger rate in Hz')
+    parser.add_argument('--duration', type=float, default=5., help='seconds per configuration')
+    parser.add_argument('--poll', action='store_true', help='poll GetNextImage instead of using image events')
+    parser.add_argument('-o', '--output', help='write JSON results to this file instead of stdout')
+    parser.add_argument('--compare', help='JSON results of a previous run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed fractional frame rate drop')
+    args = parser.parse_args(argv)
+
+    results = {
+        'version': _version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'sim_config': dict(SimSpin.SIM_CONFIG, trigger_rate=args.rate),
+        'results': [],
+    }
+    for profile in args.profiles.split(','):
+        for ext in args.extensions.split(','):
+            for n in args.writers.split(','):
+                r = run_one(ext.strip(), int(n), args.queue_size, args.ring_size, args.rate, args.duration,
+                            not args.poll, profile.strip())
+                results['results'].append(r)
+                print('%-12s %-4s writers=%-2d %7.1f frames/s  dropped=%-5d incomplete=%-4d p50=%s ms p99=%s ms  '
+                      'stats p99=%s of %.1f ms' % (
+                          r['capture_profile'], r['extension'], r['num_writers'], r['sustained_fps'],
+                          sum(r['dropped'].values()), r['incomplete'], _fmt(r['latency_p50_ms']),
+                          _fmt(r['latency_p99_ms']), _fmt(r['frame_stats_p99_ms']), r['frame_budget_ms']),
+                      file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('REGRESSION ' + line, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+def _fmt(v):
+    return '-' if v is None else '%.1f' % v
+
+
+if __name__ == '__main__':
+    sys.exit(main())